@@ -0,0 +1,66 @@
+import sys
+
+
+class AllocationAudit:
+    """
+    Debug mode that uses tracemalloc to measure how much memory each part of a frame allocates.
+    Run main.py with --audit-allocations to turn it on (it slows the game down a lot).
+    For each subsystem it records:
+    - peak: the most memory in use at once during that part of the frame (temporary allocations)
+    - retained: memory still in use at the end of it
+    - blocks: change in the number of allocated memory blocks
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.frames = 0
+        self.totals: dict = {}  # subsystem: [peak bytes, retained bytes, blocks]
+        self.subsystem = None
+        self.start_memory = 0
+        self.start_blocks = 0
+
+        if self.enabled:
+            # Imported here so that normal start-up doesn't pay for it
+            import tracemalloc
+            self.tracemalloc = tracemalloc
+            tracemalloc.start()
+
+    def begin(self, subsystem: str) -> None:
+        if not self.enabled:
+            return
+
+        self.subsystem = subsystem
+        self.tracemalloc.reset_peak()
+        self.start_memory = self.tracemalloc.get_traced_memory()[0]
+        self.start_blocks = sys.getallocatedblocks()
+
+    def end(self) -> None:
+        if not self.enabled:
+            return
+
+        current, peak = self.tracemalloc.get_traced_memory()
+        blocks = sys.getallocatedblocks() - self.start_blocks
+        if self.subsystem not in self.totals:
+            self.totals[self.subsystem] = [0, 0, 0]
+
+        totals = self.totals[self.subsystem]
+        totals[0] += peak - self.start_memory
+        totals[1] += current - self.start_memory
+        totals[2] += blocks
+
+    def end_frame(self) -> None:
+        if self.enabled:
+            self.frames += 1
+
+    def report(self) -> str:
+        """
+        :return: A table of the average allocations per frame for each subsystem
+        """
+        frames = max(self.frames, 1)
+        lines = ["Allocations per frame over " + str(self.frames) + " frames:",
+                 "{:<20}{:>12}{:>14}{:>10}".format("subsystem", "peak (B)", "retained (B)", "blocks")]
+
+        for subsystem, (peak, retained, blocks) in self.totals.items():
+            lines.append("{:<20}{:>12.1f}{:>14.1f}{:>10.2f}".format(
+                subsystem, peak / frames, retained / frames, blocks / frames))
+
+        return "\n".join(lines)
@@ -0,0 +1,149 @@
+import time
+
+
+class FrameGovernor:
+    """
+    Keeps frames inside the frame budget by lowering the quality when the game can't keep up.
+    Physics runs once per frame, so a late frame slows the whole game down rather than just dropping a frame.
+    It times each phase of a frame (like AllocationAudit does for memory), and when the average frame
+    takes longer than the budget it goes down one quality tier:
+    - tier 1: the health icons aren't drawn
+    - tier 2: enemies that are off screen are only updated every OFFSCREEN_INTERVAL frames
+      (this only saves time in levels bigger than the screen)
+    - tier 3: the frame is drawn at half resolution and scaled up
+    Once there is plenty of time left over again, it goes back up one tier at a time.
+    """
+    TIER_NAMES = ("full quality", "no health icons", "slow off-screen enemies", "half resolution")
+    OFFSCREEN_INTERVAL = 4
+
+    # Average frame cost (as a fraction of the budget) to go down a tier at, and to go back up at
+    DEGRADE_AT = 1.0
+    RECOVER_AT = 0.6
+    # How many frames in a row have to be cheap enough before going back up a tier
+    RECOVER_FRAMES = 120
+    # Frames to wait after changing tier before changing again, so the average can catch up
+    COOLDOWN_FRAMES = 30
+    # Weight of the newest frame in the running averages
+    SMOOTHING = 0.1
+
+    def __init__(self, budget_ms: float, enabled: bool = True):
+        self.budget_ms = budget_ms
+        self.enabled = enabled
+        self.tier = 0
+
+        # Statistics for tuning
+        self.frames = 0
+        self.overruns = 0
+        self.worst_ms = 0.0
+        self.frame_ms = 0.0  # Running average of the whole frame
+        self.phase_ms: dict = {}  # phase: running average
+        self.frames_at_tier = [0] * len(self.TIER_NAMES)
+        self.tier_changes = 0
+
+        self.phase = None
+        self.phase_start = 0.0
+        self.this_frame: dict = {}
+        self.calm_frames = 0
+        self.cooldown = 0
+
+    #### Quality settings for the current tier ####
+    @property
+    def show_health_icons(self) -> bool:
+        return self.tier < 1
+
+    @property
+    def offscreen_interval(self) -> int:
+        return self.OFFSCREEN_INTERVAL if self.tier >= 2 else 1
+
+    @property
+    def render_scale(self) -> float:
+        return 0.5 if self.tier >= 3 else 1
+
+    def should_update_offscreen(self) -> bool:
+        """
+        :return: Whether enemies that are off screen get updated this frame
+        """
+        return self.frames % self.offscreen_interval == 0
+
+    #### Measuring ####
+    def begin(self, phase: str) -> None:
+        if not self.enabled:
+            return
+
+        self.phase = phase
+        self.phase_start = time.perf_counter()
+
+    def end(self) -> None:
+        if not self.enabled:
+            return
+
+        elapsed = (time.perf_counter() - self.phase_start) * 1000
+        self.this_frame[self.phase] = self.this_frame.get(self.phase, 0) + elapsed
+
+    def end_frame(self) -> None:
+        """
+        Call once all the work for a frame is done (before waiting for the next frame)
+        """
+        if not self.enabled:
+            return
+
+        frame_ms = 0.0
+        for phase, elapsed in self.this_frame.items():
+            frame_ms += elapsed
+            average = self.phase_ms.get(phase, elapsed)
+            self.phase_ms[phase] = average + (elapsed - average) * self.SMOOTHING
+        self.this_frame.clear()
+
+        self.frames += 1
+        self.frames_at_tier[self.tier] += 1
+        if frame_ms > self.budget_ms:
+            self.overruns += 1
+        if frame_ms > self.worst_ms:
+            self.worst_ms = frame_ms
+        self.frame_ms += (frame_ms - self.frame_ms) * self.SMOOTHING
+
+        self.choose_tier()
+
+    def choose_tier(self) -> None:
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            return
+
+        if self.frame_ms > self.budget_ms * self.DEGRADE_AT:
+            self.calm_frames = 0
+            if self.tier < len(self.TIER_NAMES) - 1:
+                self.set_tier(self.tier + 1)
+
+        elif self.frame_ms < self.budget_ms * self.RECOVER_AT:
+            self.calm_frames += 1
+            if self.calm_frames >= self.RECOVER_FRAMES and self.tier > 0:
+                self.set_tier(self.tier - 1)
+
+        else:
+            self.calm_frames = 0
+
+    def set_tier(self, tier: int) -> None:
+        self.tier = tier
+        self.tier_changes += 1
+        self.calm_frames = 0
+        self.cooldown = self.COOLDOWN_FRAMES
+
+    def report(self) -> str:
+        """
+        :return: The current tier, how often frames went over budget, and the average cost of each phase
+        """
+        frames = max(self.frames, 1)
+        lines = ["Quality tier " + str(self.tier) + " (" + self.TIER_NAMES[self.tier] + "), changed " +
+                 str(self.tier_changes) + " times",
+                 "Over budget (" + str(round(self.budget_ms, 1)) + " ms) in " + str(self.overruns) + " of " +
+                 str(self.frames) + " frames, worst " + str(round(self.worst_ms, 1)) + " ms",
+                 "{:<24}{:>10}".format("tier", "frames (%)")]
+
+        for tier, name in enumerate(self.TIER_NAMES):
+            lines.append("{:<24}{:>10.1f}".format(name, self.frames_at_tier[tier] * 100 / frames))
+
+        lines.append("{:<24}{:>10}".format("phase", "avg (ms)"))
+        for phase, average in self.phase_ms.items():
+            lines.append("{:<24}{:>10.2f}".format(phase, average))
+
+        return "\n".join(lines)
@@ -1,8 +1,33 @@
-import struct
+import os
 
-import numpy as np
 import pygame
-from math import cos, sin
+from math import cos, sin, radians
+
+# Rects of the semi-solid platforms used by collision_update, cached so they aren't rebuilt every frame
+# (solid platforms are found through CollisionLayers instead)
+_rect_cache: dict = {}
+
+
+def cached_rects(objects: list) -> list:
+    """
+    Returns the rects of the (non-rotated) objects in a list, such as the level's semi-solid platforms,
+    reusing the same list every frame.
+    The cache only goes stale when objects are added, removed or replaced, which the level reports with
+    invalidate_rects().
+    """
+    cached = _rect_cache.get(id(objects))
+    if cached is None or cached[0] is not objects or cached[1] != len(objects):
+        cached = (objects, len(objects), [obj.rect for obj in objects if not obj.is_rotated])
+        _rect_cache[id(objects)] = cached
+    return cached[2]
+
+
+def invalidate_rects(objects: list) -> None:
+    """
+    Makes cached_rects rebuild the rects of one list (e.g. after a platform in it was replaced)
+    """
+    _rect_cache.pop(id(objects), None)
+
 
 # This is the base class of all objects in my game that have no image (they are just rectangles)
 class MySprite(pygame.sprite.Sprite):
@@ -27,9 +52,39 @@ class CollisionCharacter(MySprite):
         self.float_pos = pygame.Vector2(self.rect.center)
         self.isGrounded: bool = False
 
+        # Contact cache: the platform the character is resting on, if any.
+        # While asleep, collision_update only revalidates this one contact
+        self.resting_on = None
+        self.isAsleep: bool = False
+
     def fall(self, *args, **kwargs):
         pass
 
+    def wake(self):
+        """
+        Makes the character run its full physics again on the next collision_update
+        """
+        self.isAsleep = False
+        self.resting_on = None
+
+    def contact_is_valid(self) -> bool:
+        """
+        Checks that the character is still standing exactly on top of the cached platform
+        """
+        obj = self.resting_on
+        if obj is None or obj.is_removed:
+            return False
+
+        if type(obj) is MovingPlatform and obj.velocity.length_squared() != 0:
+            return False
+
+        if type(obj) is SemiSolidPlatform:
+            top = obj.top_side[0][1]
+        else:
+            top = obj.rect.top
+
+        return self.rect.bottom == top and self.rect.right > obj.rect.left and self.rect.left < obj.rect.right
+
     def on_top_collision(self, *args, **kwargs):
         """
         What happens when character lands on top of a platform
@@ -57,17 +112,111 @@ class CollisionCharacter(MySprite):
     def on_spike_collision(self, *args, **kwargs):
         pass
 
-    def collision_update(self, all_platforms, all_semi_solid_platforms):
-        if (self.rect.collidelist([obj.rect for obj in all_platforms]) == -1 and
-                self.rect.collidelist([obj.rect for obj in all_semi_solid_platforms]) == -1):
+    def separating_axis_collision(self, obj):
+        """
+        Collision with a rotated (sloped) platform using the separating axis theorem.
+        The platform's axes and projections are precomputed, so only the character's
+        projections have to be worked out here
+        """
+        half_width = self.rect.width / 2
+        half_height = self.rect.height / 2
+        centerx = self.rect.left + half_width
+        centery = self.rect.top + half_height
+
+        smallest_overlap = None
+        normal = (0, 0)
+        for (axis_x, axis_y), (low, high) in zip(obj.axes, obj.extents):
+            centre = centerx * axis_x + centery * axis_y
+            radius = half_width * abs(axis_x) + half_height * abs(axis_y)
+            overlap = min(centre + radius - low, high - (centre - radius))
+            if overlap <= 0:
+                # Found a separating axis, so there is no collision
+                return
+
+            if smallest_overlap is None or overlap < smallest_overlap:
+                smallest_overlap = overlap
+                # The normal points from the platform towards the character
+                if centre < (low + high) / 2:
+                    normal = (-axis_x, -axis_y)
+                else:
+                    normal = (axis_x, axis_y)
+
+        # Floors and slopes: push straight up so the character doesn't slide down the slope
+        if normal[1] < -0.5:
+            if self.ySpeed >= 0:
+                self.float_pos.y -= smallest_overlap / -normal[1]
+                self.ySpeed = 0
+                self.isGrounded = True
+                self.resting_on = obj
+                self.on_top_collision()
+
+        # Ceilings
+        elif normal[1] > 0.5:
+            self.float_pos.x += normal[0] * smallest_overlap
+            self.float_pos.y += normal[1] * smallest_overlap
+            if self.ySpeed < 0:
+                self.ySpeed = 0
+            self.on_bottom_collision()
+
+        # Walls
+        else:
+            self.float_pos.x += normal[0] * smallest_overlap
+            self.float_pos.y += normal[1] * smallest_overlap
+            self.xSpeed = 0
+            if normal[0] < 0:
+                self.on_left_collision()
+            else:
+                self.on_right_collision()
+
+        self.rect.x = round(self.float_pos.x)
+        self.rect.y = round(self.float_pos.y)
+
+    def collision_update(self, colliders, all_semi_solid_platforms):
+        """
+        :param colliders: The level's CollisionLayers (only the colliders near the character are checked)
+        :param all_semi_solid_platforms: The list of semi-solid platforms
+        """
+        # A sleeping character only needs to check the platform it is resting on
+        if self.isAsleep:
+            if self.xSpeed == 0 and self.ySpeed == 0 and self.contact_is_valid():
+                return
+            self.wake()
+
+        self.rect.x = round(self.float_pos.x)
+        self.rect.y = round(self.float_pos.y)
+
+        nearby = colliders.near(self.rect)
+
+        # Rotated platforms are left out here since their rect is only a bounding box:
+        # separating_axis_collision() sets isGrounded for them instead.
+        # The rect is 1 pixel taller for this check so that standing exactly on top of a platform counts:
+        # otherwise a resting character isn't grounded on 2 frames out of 3 (it falls, sinks 1 pixel and lands
+        # again), which changes how it accelerates and when it can jump, and sleeping would change that too
+        self.rect.height += 1
+        touching_platform = False
+        for obj in nearby:
+            if not obj.is_rotated and self.rect.colliderect(obj.rect):
+                touching_platform = True
+                break
+
+        if not touching_platform and self.rect.collidelist(cached_rects(all_semi_solid_platforms)) == -1:
             self.isGrounded = False
+        self.rect.height -= 1
 
         # Make sure that the character is falling if they are in the air
         if not self.isGrounded:
             self.fall()
 
         # This is the main collision detection algorithm for a character with regular platforms
-        for obj in all_platforms:
+        for obj in nearby:
+            # Cheap test first so that clipline (which allocates) only runs for platforms nearby
+            if not self.rect.colliderect(obj.clip_bounds):
+                continue
+
+            if obj.is_rotated:
+                self.separating_axis_collision(obj)
+                continue
+
             # Platform Lines format: top, left, right, bottom
             # We need to split the platform into edges so that we can push the player into the correct direction
             # (away from the edge)
@@ -84,6 +233,7 @@ class CollisionCharacter(MySprite):
                         if self.ySpeed > 0 and self.rect.centery <= obj.rect.topleft[1]:
                             self.ySpeed = 0
                             self.isGrounded = True
+                            self.resting_on = obj
                             diff_in_y_coord = self.rect.bottomright[1] - clipped[0][1]
                             # Now do anything extra that is required for the specific character
                             self.on_top_collision()
@@ -141,6 +291,9 @@ class CollisionCharacter(MySprite):
 
         # This is the collision detection algorithm for a character with semi-solid platforms
         for obj in all_semi_solid_platforms:
+            if not self.rect.colliderect(obj.clip_bounds):
+                continue
+
             clipped = self.rect.clipline(obj.top_side)
             # If there is a collision
             if clipped:
@@ -151,11 +304,22 @@ class CollisionCharacter(MySprite):
                     self.float_pos.y += diff_in_y_coord
                     self.isGrounded = True
                     self.ySpeed = 0
+                    self.resting_on = obj
                     self.on_top_collision()
 
+        # Go to sleep once the character has come to rest (but never on spikes, so they keep doing damage)
+        if (self.isGrounded and self.xSpeed == 0 and self.ySpeed == 0
+                and type(self.resting_on) is not Spikes and self.contact_is_valid()):
+            self.isAsleep = True
+
 
 class Player(CollisionCharacter):
-    # Some constants for the player
+    # Some constants for the player (the navigation graph uses these too, so enemies jump the same way)
+    GRAVITY = 0.3
+    JUMP_SPEED = 7.5
+    HIGH_JUMP_SPEED = 10
+    MAX_HORIZONTAL_SPEED = 5
+
     def __init__(self, size: tuple, colour, is_invulnerable_eventID, initialPos):
         super().__init__(size, colour, initialPos)
         self.orig_image = self.image.copy()
@@ -163,8 +327,8 @@ class Player(CollisionCharacter):
         self.ySpeed = 0
         self.health = 4
         self.orientation = 0
-        self.max_horizontal_speed = 5
-        self.max_vertical_speed = 7.5
+        self.max_horizontal_speed = self.MAX_HORIZONTAL_SPEED
+        self.max_vertical_speed = self.JUMP_SPEED
         self.isGrounded: bool = False
         self.isSpinning: bool = False
         self.canGroundPound: bool = True
@@ -207,10 +371,15 @@ class Player(CollisionCharacter):
 
     def fall(self):
         # Remember that down on the y-axis is positive and the top of the screen is (0,0)
-        self.ySpeed += 0.3
+        self.ySpeed += self.GRAVITY
         if self.ySpeed > self.max_vertical_speed:
             self.ySpeed = self.max_vertical_speed
 
+    def start_ground_pound(self) -> None:
+        if not self.isGrounded and not self.isSpinning and self.canGroundPound:
+            self.isSpinning = True
+            self.rotate(3.6)
+
     def ground_pound(self, clock):
         self.xSpeed = 0
         self.ySpeed = 0
@@ -247,12 +416,42 @@ class Player(CollisionCharacter):
             if self.xSpeed > 0:
                 self.xSpeed = 0
 
+    def handle_input(self, left: bool, right: bool, jump: bool, highJump: bool) -> None:
+        """
+        Applies one frame of the player's controls (main.py reads these from the keyboard)
+        """
+        if left:
+            if not self.isGrounded:
+                self.xSpeed -= 0.2
+            else:
+                self.xSpeed -= 1
+
+            # We do not want to accelerate past our max speed
+            if self.xSpeed < -1 * self.max_horizontal_speed:
+                self.xSpeed = -self.max_horizontal_speed
+
+        elif right:
+            if not self.isGrounded:
+                self.xSpeed += 0.2
+            else:
+                self.xSpeed += 1
+
+            if self.xSpeed > self.max_horizontal_speed:
+                self.xSpeed = self.max_horizontal_speed
+
+        # If neither left nor right is pressed
+        else:
+            self.decelerate()
+
+        if jump:
+            self.jump(highJump=highJump)
+
     def jump(self, highJump):
         if self.isGrounded:
             if highJump:
-                self.max_vertical_speed = 10
+                self.max_vertical_speed = self.HIGH_JUMP_SPEED
             else:
-                self.max_vertical_speed = 7.5
+                self.max_vertical_speed = self.JUMP_SPEED
 
             self.ySpeed = -1 * self.max_vertical_speed
             self.isGrounded = False
@@ -268,6 +467,7 @@ class Fool(CollisionCharacter):
 
     def __init__(self, initialPos):
         super().__init__((20, 20), (255, 0, 0), initialPos)
+        self.spawn_point = tuple(initialPos)  # Saved in the level file instead of wherever it has walked to
         self.MAX_VERTICAL_SPEED = 7.5  # Allows Fool to accelerate downwards (not necessary for all enemies)
         self.internal_timer = 0  # Used for squishing animation
         self.isBeingSquished = False
@@ -297,14 +497,14 @@ class Fool(CollisionCharacter):
     def on_right_collision(self, *args, **kwargs):
         self.xSpeed = 2
 
-    def update(self, all_platforms, all_semi_solid_platforms) -> None:
+    def update(self, colliders, all_semi_solid_platforms) -> None:
         """
         This is a simple function that contains the main logic of the Fool
         but does not include interactions with the player (that's in main.py)
         """
         self.float_pos.x += self.xSpeed
         self.float_pos.y += self.ySpeed
-        self.collision_update(all_platforms, all_semi_solid_platforms)
+        self.collision_update(colliders, all_semi_solid_platforms)
 
 class GhostPursuer(MySprite):
     """
@@ -319,17 +519,19 @@ class GhostPursuer(MySprite):
         # The ghost starts fully transparent
         GHOST_RADIUS = 10
         super().__init__((20, 20), (0, 0, 0, 255), initialPos)
+        self.spawn_point = tuple(initialPos)  # Saved in the level file instead of wherever it has floated to
         pygame.draw.circle(self.image, (255, 0, 0, 50), (GHOST_RADIUS, GHOST_RADIUS), GHOST_RADIUS)
         self.collision_rect = self.rect.copy()
         self.collision_rect.scale_by_ip(0.8, 0.8)
         self.floatingPointCenter: pygame.Vector2 = pygame.Vector2(self.rect.center)
+        self.translation = pygame.Vector2()  # Reused every frame instead of making a new vector
         self.MAX_SPEED = 1.7
 
     def update(self, player_position: tuple):
         # Calculate difference between x and difference between y
         diff_in_x: float = player_position[0] - self.rect.centerx
         diff_in_y: float = player_position[1] - self.rect.centery
-        translation = pygame.Vector2()
+        translation = self.translation
 
         if diff_in_x != 0:
             gradient = diff_in_y / diff_in_x
@@ -345,8 +547,10 @@ class GhostPursuer(MySprite):
             translation.update(-1 * translation.x, -1 * translation.y)
 
         self.floatingPointCenter += translation
-        self.rect.center = round(self.floatingPointCenter.x), round(self.floatingPointCenter.y)
-        self.collision_rect.center = self.rect.center
+        self.rect.centerx = round(self.floatingPointCenter.x)
+        self.rect.centery = round(self.floatingPointCenter.y)
+        self.collision_rect.centerx = self.rect.centerx
+        self.collision_rect.centery = self.rect.centery
 
 class JumpingFool(Fool):
     character_code = "2"
@@ -360,26 +564,113 @@ class JumpingFool(Fool):
         # Initiate jump again
         self.ySpeed = -8
 
+
+class HunterFool(Fool):
+    """
+    A Fool that chases the player, using the level's navigation graph (see navigation.py)
+    to walk, fall and jump between platforms
+    """
+    character_code = "3"
+    SPEED = 2
+    TAKEOFF_TOLERANCE = 6  # It moves SPEED pixels a frame, so the take-off point can't be hit exactly
+
+    def __init__(self, initialPos):
+        super().__init__(initialPos)
+        self.xSpeed = 0
+        self.route = None  # The next edge of the navigation graph to follow
+        self.landing_x = None  # Where to steer to while in the air
+        self.replan_timer = 0
+
+    def jump(self, highJump):
+        self.MAX_VERTICAL_SPEED = Player.HIGH_JUMP_SPEED if highJump else Player.JUMP_SPEED
+        self.ySpeed = -self.MAX_VERTICAL_SPEED
+        self.isGrounded = False
+
+    def steer(self, target: tuple) -> None:
+        if self.route is None:
+            # Already on the same surface as the target
+            aim_x = target[0]
+        else:
+            aim_x = self.route.takeoff_x
+
+        if abs(self.rect.centerx - aim_x) > self.TAKEOFF_TOLERANCE:
+            self.xSpeed = self.SPEED if aim_x > self.rect.centerx else -self.SPEED
+            return
+
+        if self.route is None:
+            self.xSpeed = 0
+            return
+
+        # At the take-off point: head for the landing point, jumping if needed
+        self.xSpeed = self.SPEED if self.route.landing_x > self.rect.centerx else -self.SPEED
+        self.landing_x = self.route.landing_x
+        if self.route.kind == "jump" or self.route.kind == "high jump":
+            self.jump(highJump=self.route.kind == "high jump")
+        self.route = None
+        self.replan_timer = 0
+
+    def update(self, colliders, all_semi_solid_platforms, navigation=None, target=None) -> None:
+        """
+        :param navigation: The level's NavigationGraph
+        :param target: The point to chase (e.g. the bottom middle of the player)
+        """
+        if navigation is not None and target is not None and self.isGrounded:
+            self.landing_x = None
+            self.replan_timer -= 1
+            if self.replan_timer <= 0:
+                self.route = navigation.next_edge(self.rect.midbottom, target)
+                self.replan_timer = 15
+            self.steer(target)
+
+        elif self.landing_x is not None:
+            # Steer in the air so the jump doesn't overshoot the landing point
+            if abs(self.rect.centerx - self.landing_x) <= self.SPEED:
+                self.xSpeed = 0
+            else:
+                self.xSpeed = self.SPEED if self.landing_x > self.rect.centerx else -self.SPEED
+
+        super().update(colliders, all_semi_solid_platforms)
+
 class Platform(MySprite):
     code = "0"
+    is_rotated = False
+    is_removed = False  # Set when a level editor deletes or replaces the platform
 
     def __init__(self, size, colour, position, orientation=0):
         super().__init__(size, colour, position)
-        self.orientation = orientation  # obsolete/ will not use (for now)
-
-        # Rotate the image of the platform and update the rectangle
-        # self.image = pygame.transform.rotozoom(self.image, -self.orientation, 1)
-        # self.rect = self.image.get_rect(center=self.rect.center)
+        self.orientation = orientation  # Clockwise rotation in degrees
+        self.size = tuple(size)  # The size before rotation (the rect becomes the bounding box)
 
         # Top, left, right, bottom
         self.sides: list = []
 
-        # Top left, top right, bottom left, bottom right
+        # Data for the separating axis test, worked out once in set_sides():
+        # the axes to test against and the platform's (min, max) projection onto each one
+        self.corners: list = []
+        self.axes: list = []
+        self.extents: list = []
+
+        # Slightly bigger than the platform, since clipline also hits the right and bottom edges
+        self.clip_bounds = pygame.Rect(0, 0, 0, 0)
+
+        if self.orientation % 90 != 0:
+            self.is_rotated = True
+            # Rotate the image of the platform and update the rectangle
+            self.image = pygame.transform.rotozoom(self.image, -self.orientation, 1)
+            self.rect = self.image.get_rect(center=self.rect.center)
+
+        elif self.orientation % 180 != 0:
+            # A quarter turn stays axis-aligned, so it only swaps the width and height (around the centre,
+            # the same as the rotated platforms above) and the normal collision is still used
+            self.image = pygame.transform.rotate(self.image, -self.orientation)
+            self.rect = self.image.get_rect(center=self.rect.center)
+
+        # Top left, top right, bottom left, bottom right (y is down, like the screen)
         self.orig_corners = [
-            (-0.5 * self.rect.w, 0.5 * self.rect.h),
-            (0.5 * self.rect.w, 0.5 * self.rect.h),
-            (-0.5 * self.rect.w, -0.5 * self.rect.h),
-            (0.5 * self.rect.w, -0.5 * self.rect.h)
+            (-0.5 * self.size[0], -0.5 * self.size[1]),
+            (0.5 * self.size[0], -0.5 * self.size[1]),
+            (-0.5 * self.size[0], 0.5 * self.size[1]),
+            (0.5 * self.size[0], 0.5 * self.size[1])
         ]
 
         self.set_sides()
@@ -390,16 +681,20 @@ class Platform(MySprite):
         Then it uses that data to set the top sides
         """
         new_corners = []
+        self.clip_bounds.update(self.rect.left - 1, self.rect.top - 1, self.rect.width + 2, self.rect.height + 2)
 
-        if self.orientation % 90 != 0:
+        if self.is_rotated:
             # Formula:
             # new_x = xcosθ - ysinθ
             # new_y = xsinθ + ycosθ
+            angle = radians(self.orientation)
+            cos_angle = cos(angle)
+            sin_angle = sin(angle)
+            centerx = self.rect.left + self.rect.width / 2
+            centery = self.rect.top + self.rect.height / 2
             for i in range(4):
-                x = (self.rect.centerx + (self.orig_corners[i][0] * cos(self.orientation))
-                     - (self.orig_corners[i][1] * sin(self.orientation)))
-                y = (self.rect.centery + (self.orig_corners[i][0]*sin(self.orientation))
-                     + (self.orig_corners[i][1] * cos(self.orientation)))
+                x = centerx + (self.orig_corners[i][0] * cos_angle) - (self.orig_corners[i][1] * sin_angle)
+                y = centery + (self.orig_corners[i][0] * sin_angle) + (self.orig_corners[i][1] * cos_angle)
                 new_corners.append((x, y))
 
             self.sides = [
@@ -409,6 +704,15 @@ class Platform(MySprite):
                 (new_corners[2], new_corners[3])
             ]
 
+            # A character is an axis-aligned rectangle, so the axes to test are the world x and y axes
+            # plus the two edge normals of the platform
+            self.corners = new_corners
+            self.axes = [(1, 0), (0, 1), (cos_angle, sin_angle), (-sin_angle, cos_angle)]
+            self.extents = []
+            for axis in self.axes:
+                projections = [x * axis[0] + y * axis[1] for x, y in new_corners]
+                self.extents.append((min(projections), max(projections)))
+
         else:
             temp_rect = self.image.get_rect(center=self.rect.center)
             self.sides = [
@@ -513,6 +817,7 @@ class Spikes(Platform):
                       (self.rect.topright, self.rect.bottomright),
                       (self.rect.bottomleft, self.rect.bottomright)
                       ]
+        self.clip_bounds = self.rect.inflate(2, 2)
 
 
 class SemiSolidPlatform(MySprite):
@@ -522,10 +827,13 @@ class SemiSolidPlatform(MySprite):
     """
 
     code = "2"
+    is_rotated = False
+    is_removed = False
 
     def __init__(self, size, position):
         super().__init__(size, (255, 0, 255), position)
         self.top_side = (self.rect.topleft, self.rect.topright)
+        self.clip_bounds = self.rect.inflate(2, 2)
         self.orientation = 0
 
 
@@ -586,9 +894,400 @@ class MovingPlatform(Platform):
             self.set_sides()
 
 
+class StaticCollider:
+    """
+    A collision-only rectangle made by merging several static platforms together.
+    It has no image: the original platforms are still drawn, this is only used by collision_update
+    """
+    code = "0"
+    is_rotated = False
+    is_removed = False
+
+    def __init__(self, rect: pygame.Rect):
+        self.rect = rect
+        self.orientation = 0
+
+        # Top, left, right, bottom (same order as Platform.sides)
+        self.sides = [
+            (self.rect.topleft, self.rect.topright),
+            (self.rect.topleft, self.rect.bottomleft),
+            (self.rect.topright, self.rect.bottomright),
+            (self.rect.bottomright, self.rect.bottomleft)
+        ]
+        self.clip_bounds = self.rect.inflate(2, 2)
+
+
+def _merge_runs(rects: list, horizontal: bool) -> list:
+    """
+    Merges rectangles that share the same row (or column) and touch or overlap along it
+    :param horizontal: True to join rectangles side by side, False to stack them on top of each other
+    """
+    rows = {}
+    for rect in rects:
+        key = (rect.top, rect.height) if horizontal else (rect.left, rect.width)
+        rows.setdefault(key, []).append(rect)
+
+    merged = []
+    for row in rows.values():
+        row.sort(key=lambda r: r.left if horizontal else r.top)
+        current = row[0].copy()
+        for rect in row[1:]:
+            if horizontal and rect.left <= current.right:
+                current.width = max(current.right, rect.right) - current.left
+            elif not horizontal and rect.top <= current.bottom:
+                current.height = max(current.bottom, rect.bottom) - current.top
+            else:
+                merged.append(current)
+                current = rect.copy()
+        merged.append(current)
+
+    return merged
+
+
+def merge_static_colliders(platforms: list) -> list:
+    """
+    Load-time optimisation: joins adjacent or overlapping plain Platforms into as few collision
+    rectangles as possible. Spikes and moving platforms are kept as they are, since they need
+    their own collision behaviour.
+    :param platforms: The solid platforms in the level
+    :return: A new list of colliders to pass to collision_update instead of the platforms
+    """
+    rects = []
+    others = []
+    for platform in platforms:
+        if type(platform) is Platform and not platform.is_rotated:
+            rects.append(platform.rect.copy())
+        else:
+            others.append(platform)
+
+    return [StaticCollider(rect) for rect in merge_rects(rects)] + others
+
+
+def merge_rects(rects: list) -> list:
+    """
+    Joins adjacent or overlapping rectangles into as few as possible, covering exactly the same area
+    (used at load time, and by level edits for the colliders around the edit)
+    :return: A new list of rectangles
+    """
+    # Keep joining rows and columns until nothing else can be merged
+    previous_count = -1
+    while rects and len(rects) != previous_count:
+        previous_count = len(rects)
+        rects = _merge_runs(rects, horizontal=True)
+        rects = _merge_runs(rects, horizontal=False)
+
+        # Drop anything that is completely inside a bigger rectangle.
+        # Only the bigger rectangles in the same grid cells can contain it, so they are found with a grid
+        rects.sort(key=lambda r: r.width * r.height, reverse=True)
+        kept = []
+        kept_index = SpatialGrid()
+        for rect in rects:
+            if not any(kept[i].contains(rect) for i in kept_index.query(rect)):
+                kept_index.insert(len(kept), rect)
+                kept.append(rect)
+        rects = kept
+
+    return rects
+
+
+def subtract_rect(rect: pygame.Rect, hole: pygame.Rect) -> list:
+    """
+    :return: Up to 4 rectangles that cover the parts of rect outside the hole
+    """
+    if not rect.colliderect(hole):
+        return [rect]
+
+    pieces = []
+    if hole.top > rect.top:
+        pieces.append(pygame.Rect(rect.left, rect.top, rect.width, hole.top - rect.top))
+    if hole.bottom < rect.bottom:
+        pieces.append(pygame.Rect(rect.left, hole.bottom, rect.width, rect.bottom - hole.bottom))
+
+    top = max(rect.top, hole.top)
+    bottom = min(rect.bottom, hole.bottom)
+    if hole.left > rect.left:
+        pieces.append(pygame.Rect(rect.left, top, hole.left - rect.left, bottom - top))
+    if hole.right < rect.right:
+        pieces.append(pygame.Rect(hole.right, top, rect.right - hole.right, bottom - top))
+
+    return pieces
+
+
+class SpatialGrid:
+    """
+    A uniform grid (spatial hash). Each object is stored in every cell its rect touches,
+    so adding, removing or moving one object only touches the cells it covers
+    """
+    def __init__(self, cell_size: int = 64):
+        self.cell_size = cell_size
+        # (column, row): {object: the rect it was inserted with} (a dict keeps the order things were added)
+        self.cells: dict = {}
+        self.object_cells: dict = {}  # object: the cells it is stored in
+
+    def cells_for(self, rect: pygame.Rect) -> list:
+        size = self.cell_size
+        right = max(rect.right - 1, rect.left)
+        bottom = max(rect.bottom - 1, rect.top)
+        return [(column, row)
+                for column in range(rect.left // size, right // size + 1)
+                for row in range(rect.top // size, bottom // size + 1)]
+
+    def insert(self, obj, rect: pygame.Rect = None) -> None:
+        if rect is None:
+            rect = obj.rect
+
+        keys = self.cells_for(rect)
+        self.object_cells[obj] = keys
+        # A copy, so that objects that move (e.g. enemies) are still found where they were indexed
+        rect = rect.copy()
+        for key in keys:
+            if key not in self.cells:
+                self.cells[key] = {}
+            self.cells[key][obj] = rect
+
+    def remove(self, obj) -> None:
+        for key in self.object_cells.pop(obj, ()):
+            cell = self.cells[key]
+            del cell[obj]
+            if not cell:
+                del self.cells[key]
+
+    def move(self, obj, rect: pygame.Rect = None) -> None:
+        self.remove(obj)
+        self.insert(obj, rect)
+
+    def move_if_needed(self, obj, rect: pygame.Rect) -> None:
+        """
+        Moves an object to the cells of a new rect, but only if they are different from the cells it is in
+        (objects are stored in a block of cells, so checking the first and last one is enough)
+        """
+        keys = self.object_cells.get(obj)
+        if keys:
+            size = self.cell_size
+            first = keys[0]
+            last = keys[-1]
+            if (first[0] == rect.left // size and first[1] == rect.top // size and
+                    last[0] == max(rect.right - 1, rect.left) // size and
+                    last[1] == max(rect.bottom - 1, rect.top) // size):
+                return
+
+        self.move(obj, rect)
+
+    def query(self, rect: pygame.Rect) -> list:
+        """
+        :return: Every object stored in the cells that the rect touches (it may not overlap the rect itself)
+        """
+        found = {}
+        for key in self.cells_for(rect):
+            if key in self.cells:
+                found.update(self.cells[key])
+        return list(found)
+
+    def query_into(self, rect: pygame.Rect, found: list) -> None:
+        """
+        Like query(), but adds the objects to the end of an existing list (if they aren't in it already),
+        so code that runs every frame doesn't have to make new containers
+        """
+        size = self.cell_size
+        for column in range(rect.left // size, max(rect.right - 1, rect.left) // size + 1):
+            for row in range(rect.top // size, max(rect.bottom - 1, rect.top) // size + 1):
+                cell = self.cells.get((column, row))
+                if cell is not None:
+                    for obj in cell:
+                        if obj not in found:
+                            found.append(obj)
+
+    def query_point(self, point: tuple) -> list:
+        """
+        :return: The objects whose rect (as it was when they were inserted) contains the point
+        """
+        key = (point[0] // self.cell_size, point[1] // self.cell_size)
+        return [obj for obj, rect in self.cells.get(key, {}).items() if rect.collidepoint(point)]
+
+
+class CollisionLayers:
+    """
+    The solid colliders of a level, split into two layers so that characters only check the ones near them:
+    - static: merged platforms, spikes and rotated platforms. They never move, so their grid is built once
+      (level edits update it incrementally)
+    - moving: moving platforms. Their grid is updated every frame after they move, using bounds that also
+      cover where they will be on the next frame
+    Collision runs every frame for every character, so the rects and the list used for queries are reused
+    instead of being made again each time.
+    """
+    # How far around a character to look for colliders (more than anything moves in a frame)
+    QUERY_MARGIN = 16
+
+    def __init__(self):
+        # collider: None (dicts are used as ordered sets, so an edit can remove one without searching a list)
+        self.static: dict = {}
+        self.static_index = SpatialGrid()
+        self.moving: dict = {}
+        self.dynamic_index = SpatialGrid()
+
+        self.query_area = pygame.Rect(0, 0, 0, 0)
+        self.found: list = []
+        self.bounds = pygame.Rect(0, 0, 0, 0)
+
+    def swept_bounds(self, platform) -> pygame.Rect:
+        """
+        :return: The area a moving platform covers now and after its next move (including the row above it
+        that carries characters). The same rect is reused on every call
+        """
+        clip_bounds = platform.clip_bounds
+        dx = int(platform.velocity.x)
+        dy = int(platform.velocity.y)
+        self.bounds.update(clip_bounds.left + min(dx, 0), clip_bounds.top + min(dy, 0),
+                           clip_bounds.width + abs(dx), clip_bounds.height + abs(dy))
+        return self.bounds
+
+    def add(self, collider) -> None:
+        if type(collider) is MovingPlatform:
+            self.moving[collider] = None
+            self.dynamic_index.insert(collider, self.swept_bounds(collider))
+        else:
+            self.static[collider] = None
+            self.static_index.insert(collider)
+
+    def remove(self, collider) -> None:
+        if type(collider) is MovingPlatform:
+            del self.moving[collider]
+            self.dynamic_index.remove(collider)
+        else:
+            del self.static[collider]
+            self.static_index.remove(collider)
+
+    def update_moving(self, clock: pygame.time.Clock) -> None:
+        """
+        Moves every moving platform, and moves them in their grid if they have gone into different cells
+        """
+        for platform in self.moving:
+            platform.update(clock)
+            self.dynamic_index.move_if_needed(platform, self.swept_bounds(platform))
+
+    def near(self, rect: pygame.Rect) -> list:
+        """
+        :return: The static colliders, then the moving platforms, that could touch the rect this frame.
+        The same list is reused by the next call, so it must not be kept
+        """
+        margin = self.QUERY_MARGIN
+        self.query_area.update(rect.left - margin, rect.top - margin, rect.width + 2 * margin,
+                               rect.height + 2 * margin)
+        self.found.clear()
+        self.static_index.query_into(self.query_area, self.found)
+        self.dynamic_index.query_into(self.query_area, self.found)
+        return self.found
+
+
+class SweepAndPrune:
+    """
+    Broadphase for dynamic entities (the player and enemies).
+    Entities are kept sorted by the left edge of their collision box. They only move a few pixels each frame,
+    so the list stays nearly sorted and the insertion sort in sort() is close to O(n).
+    Overlapping pairs are passed to handlers registered for their types.
+    Removed entities are only taken out of the list by the next sort(), which goes through it anyway,
+    so removing one doesn't have to search the list.
+    """
+    def __init__(self):
+        self.entities: list = []
+        self.members: set = set()
+        self.removed: set = set()  # Entities still in the list that sort() has to take out
+        self.handlers: dict = {}
+        self.active: list = []  # Scratch list reused by candidate_pairs()
+
+    def add(self, entity) -> None:
+        if entity in self.removed:
+            # It is still in the list, so it only has to stop being removed
+            self.removed.remove(entity)
+            self.members.add(entity)
+        elif entity not in self.members:
+            self.entities.append(entity)
+            self.members.add(entity)
+
+    def remove(self, entity) -> None:
+        if entity in self.members:
+            self.members.remove(entity)
+            self.removed.add(entity)
+
+    def register_handler(self, type_a, type_b, handler) -> None:
+        """
+        :param handler: A function taking (entity_a, entity_b), called when an entity of type_a
+        overlaps an entity of type_b
+        """
+        self.handlers[(type_a, type_b)] = handler
+
+    @staticmethod
+    def bounds(entity) -> pygame.Rect:
+        # Some enemies (e.g. the ghost pursuer) have a smaller box for collisions than their image
+        return getattr(entity, "collision_rect", entity.rect)
+
+    def sort(self) -> None:
+        entities = self.entities
+        if self.removed:
+            kept = 0
+            for entity in entities:
+                if entity not in self.removed:
+                    entities[kept] = entity
+                    kept += 1
+            del entities[kept:]
+            self.removed.clear()
+
+        for i in range(1, len(entities)):
+            entity = entities[i]
+            left = self.bounds(entity).left
+            j = i - 1
+            while j >= 0 and self.bounds(entities[j]).left > left:
+                entities[j + 1] = entities[j]
+                j -= 1
+            entities[j + 1] = entity
+
+    def candidate_pairs(self):
+        """
+        Yields every pair of entities whose collision boxes overlap
+        """
+        self.sort()
+        active = self.active
+        active.clear()
+        for entity in self.entities:
+            rect = self.bounds(entity)
+            # Anything that ends before this entity starts can never overlap with the rest of the list
+            kept = 0
+            for other in active:
+                if self.bounds(other).right > rect.left:
+                    active[kept] = other
+                    kept += 1
+            del active[kept:]
+
+            for other in active:
+                other_rect = self.bounds(other)
+                if other_rect.top < rect.bottom and rect.top < other_rect.bottom:
+                    yield other, entity
+            active.append(entity)
+
+    def dispatch(self) -> None:
+        for entity_a, entity_b in list(self.candidate_pairs()):
+            # An earlier handler may have removed one of them (e.g. an enemy that was killed)
+            if entity_a not in self.members or entity_b not in self.members:
+                continue
+
+            handler = self.handlers.get((type(entity_a), type(entity_b)))
+            if handler is not None:
+                handler(entity_a, entity_b)
+                continue
+
+            handler = self.handlers.get((type(entity_b), type(entity_a)))
+            if handler is not None:
+                handler(entity_b, entity_a)
+
+
 class GameLevel:
     """
     This class represents a full level, and all the data associated with it.
+    It also has an editing API (add, move, resize and delete objects, with undo and redo) for a level creator.
+    Edits are applied incrementally: only the changed objects (and the colliders around them) are updated
+    in the spatial indexes and the static render layer, and each edit is appended to a journal file
+    next to the level file.
+    save() writes the full level file again and clears the journal.
     """
     def __init__(self, filePath):
         """
@@ -596,14 +1295,40 @@ class GameLevel:
         It then unpacks the data and stores it accordingly
         :param filePath: a string that is the path to the file
         """
+        self.file_path = filePath
+        self.journal_path = filePath + ".edits"
 
-
-        self.all_platforms = [Spikes(8, 20, (150, 100), 0)]
+        self.all_platforms: dict = {}  # platform: None (an ordered set, so edits can remove one quickly)
         self.all_semi_solid_platforms = []
+        # Collision uses these instead of all_platforms: static platforms are merged once everything is loaded,
+        # and moving platforms are kept in their own layer
+        self.colliders = CollisionLayers()
+        self.all_colliders = self.colliders.static
+        self.moving_platforms = self.colliders.moving
         self.all_enemies = pygame.sprite.Group()
+        # Interactions between enemies (and the player, which the game adds itself).
+        # It is kept here so that adding or deleting an enemy in an editor updates it too
+        self.broadphase = SweepAndPrune()
         self.respawn_point: tuple = (0, 0)
         self.objectiveType = 0  # Not used for now
 
+        # Every platform and enemy has an ID so edits can be saved to the journal and undone
+        self.objects: dict = {}  # ID: object
+        self.ids: dict = {}  # object: ID
+        self.next_id = 0
+        self.undo_stack: list = []  # (ID, kind, line before, line after)
+        self.redo_stack: list = []
+
+        # object_index holds everything that can be picked in an editor (at its starting position, even after
+        # it has moved in the game).
+        # collision_index holds the static colliders
+        self.object_index = SpatialGrid()
+        self.collision_index = self.colliders.static_index
+        self.static_layer = None  # Made by build_static_layer()
+        # Called with the changed area after an edit redraws part of the static layer (e.g. to clear a copy of it)
+        self.on_static_layer_redrawn = None
+        self.loading = True
+
         # Time to read the file
         with open(filePath, "rt") as file:
             split_data = file.readline().split()
@@ -614,64 +1339,396 @@ class GameLevel:
 
             # Record enemy data
             for i in range(noEnemies):
-                split_data = file.readline().split()
-
-                if int(split_data[0]) == 0:
-                    # Record fool data
-                    self.all_enemies.add(Fool((int(split_data[1]), int(split_data[2]))))
-
-                elif int(split_data[0]) == 1:
-                    # Record ghost pursuer
-                    self.all_enemies.add(GhostPursuer((int(split_data[1]), int(split_data[2]))))
-
-                elif int(split_data[0]) == 2:
-                    # Record jumping fool
-                    self.all_enemies.add(JumpingFool((int(split_data[1]), int(split_data[2]))))
+                self.add_object(self.next_id, "E", self.enemy_from_line(file.readline().split()))
+                self.next_id += 1
 
             # Record platform data
             for i in range(noPlatforms):
-                # Split the data up
-                split_data = file.readline().split()
-                if split_data[0] == "00":
-                    # We are dealing with a stationary solid platform
-                    self.all_platforms.append(
-                        Platform(size=(int(split_data[1]), int(split_data[2])),
-                                 colour=(0, 255, 0),
-                                 orientation=int(split_data[3]),
-                                 position=(int(split_data[4]), int(split_data[5]))
-                                 )
-                    )
-
-                elif split_data[0] == "10":
-                    # We are dealing with spikes
-                    # Calculate the number of triangles
-                    noTriangles = int(int(split_data[1])/20)
-                    self.all_platforms.append(
-                        Spikes(noTriangles=noTriangles,
-                               height=int(split_data[2]),
-                               orientation=int(split_data[3]),
-                               position=(int(split_data[4]), int(split_data[5]))
-                               )
-                    )
-
-
-                elif split_data[0] == "20":
-                    # We are dealing with a stationary semi-solid platform
-                    self.all_semi_solid_platforms.append(
-                        SemiSolidPlatform(size=(int(split_data[1]), int(split_data[2])),
-                                          position=(int(split_data[4]), int(split_data[5]))
-                                          )
-                    )
-                elif split_data[0] == "01":
-                    # We are dealing with a moving solid platform
-                    platform = MovingPlatform(
-                            size=(int(split_data[1]), int(split_data[2])),
+                self.add_object(self.next_id, "P", self.platform_from_line(file.readline().split()))
+                self.next_id += 1
+
+        # Now replay any edits that haven't been saved into the level file yet
+        try:
+            with open(self.journal_path, "rt") as journal:
+                for line in journal:
+                    object_id, kind, data = line.rstrip("\n").split(" ", 2)
+                    self.apply(int(object_id), kind, None if data == "-" else data)
+                    self.next_id = max(self.next_id, int(object_id) + 1)
+        except FileNotFoundError:
+            pass
+
+        # all_platforms is kept for drawing; collision uses the merged colliders instead
+        self.loading = False
+        self.collider_count_before = len(self.all_platforms)
+        for collider in merge_static_colliders(self.all_platforms):
+            self.add_collider(collider)
+        self.collider_count_after = len(self.all_colliders) + len(self.moving_platforms)
+
+    @staticmethod
+    def enemy_from_line(split_data: list):
+        if int(split_data[0]) == 0:
+            # Record fool data
+            return Fool((int(split_data[1]), int(split_data[2])))
+
+        elif int(split_data[0]) == 1:
+            # Record ghost pursuer
+            return GhostPursuer((int(split_data[1]), int(split_data[2])))
+
+        elif int(split_data[0]) == 2:
+            # Record jumping fool
+            return JumpingFool((int(split_data[1]), int(split_data[2])))
+
+        elif int(split_data[0]) == 3:
+            # Record hunter fool
+            return HunterFool((int(split_data[1]), int(split_data[2])))
+
+        raise ValueError("Unknown enemy type: " + split_data[0])
+
+    @staticmethod
+    def platform_from_line(split_data: list):
+        if split_data[0] == "00":
+            # We are dealing with a stationary solid platform
+            return Platform(size=(int(split_data[1]), int(split_data[2])),
                             colour=(0, 255, 0),
-                            start_point=(int(split_data[4]), int(split_data[5])),
-                            end_point=(int(split_data[6]), int(split_data[7]))
-                                 )
-                    self.all_platforms.append(platform)
+                            orientation=int(split_data[3]),
+                            position=(int(split_data[4]), int(split_data[5]))
+                            )
+
+        elif split_data[0] == "10":
+            # We are dealing with spikes
+            # Calculate the number of triangles
+            noTriangles = int(int(split_data[1])/20)
+            return Spikes(noTriangles=noTriangles,
+                          height=int(split_data[2]),
+                          orientation=int(split_data[3]),
+                          position=(int(split_data[4]), int(split_data[5]))
+                          )
+
+        elif split_data[0] == "20":
+            # We are dealing with a stationary semi-solid platform
+            return SemiSolidPlatform(size=(int(split_data[1]), int(split_data[2])),
+                                     position=(int(split_data[4]), int(split_data[5]))
+                                     )
+
+        elif split_data[0] == "01":
+            # We are dealing with a moving solid platform
+            return MovingPlatform(size=(int(split_data[1]), int(split_data[2])),
+                                  colour=(0, 255, 0),
+                                  start_point=(int(split_data[4]), int(split_data[5])),
+                                  end_point=(int(split_data[6]), int(split_data[7]))
+                                  )
+
+        raise ValueError("Unknown platform type: " + split_data[0])
+
+    @staticmethod
+    def enemy_to_line(enemy) -> str:
+        # For now, all enemies just have an initial position
+        return enemy.character_code + " " + str(enemy.spawn_point[0]) + " " + str(enemy.spawn_point[1])
+
+    @staticmethod
+    def platform_to_line(platform) -> str:
+        # There is no space after platform code on purpose
+        # Determine whether the platform is moving or not
+        isMoving = type(platform) is MovingPlatform
+        line = platform.code + str(int(isMoving)) + " "
+
+        # Write the dimensions, orientation and starting position
+        # Rotated platforms (including quarter turns) are saved with their unrotated size and position,
+        # so they load back the same
+        if isinstance(platform, Platform) and (platform.is_rotated or platform.orientation % 180 != 0):
+            width, height = platform.size
+            left = platform.rect.centerx - width // 2
+            top = platform.rect.centery - height // 2
+        elif isMoving:
+            width, height = platform.rect.size
+            left, top = platform.path[0]
+        else:
+            width, height = platform.rect.size
+            left, top = platform.rect.topleft
+        line += str(width) + " " + str(height) + " " + str(platform.orientation) + " " + str(left) + " " + str(top)
+
+        if isMoving:
+            # Write the end positions of the platforms as well
+            line += " " + str(platform.path[1][0]) + " " + str(platform.path[1][1])
+
+        return line
+
+    #### Keeping the lists, indexes and render layer up to date ####
+    def add_object(self, object_id: int, kind: str, obj) -> None:
+        self.objects[object_id] = obj
+        self.ids[obj] = object_id
+        self.object_index.insert(obj)
+
+        if kind == "E":
+            self.all_enemies.add(obj)
+            self.broadphase.add(obj)
+            return
+
+        if type(obj) is SemiSolidPlatform:
+            self.all_semi_solid_platforms.append(obj)
+            invalidate_rects(self.all_semi_solid_platforms)
+        else:
+            self.all_platforms[obj] = None
+            # Colliders are only set up after the whole file is loaded
+            if not self.loading:
+                if type(obj) is Platform and not obj.is_rotated:
+                    self.merge_colliders_near(obj.rect, [obj.rect.copy()])
+                else:
+                    self.add_collider(obj)
+
+        self.redraw_static_layer(obj.rect)
 
+    def remove_object(self, object_id: int):
+        obj = self.objects.pop(object_id)
+        del self.ids[obj]
+        self.object_index.remove(obj)
+
+        if not isinstance(obj, (Platform, SemiSolidPlatform)):
+            obj.kill()
+            self.broadphase.remove(obj)
+            return obj
+
+        # Let any character resting on it know that it has gone
+        obj.is_removed = True
+        if type(obj) is SemiSolidPlatform:
+            self.all_semi_solid_platforms.remove(obj)
+            invalidate_rects(self.all_semi_solid_platforms)
+        else:
+            del self.all_platforms[obj]
+            if not self.loading:
+                self.remove_platform_collider(obj)
+
+        self.redraw_static_layer(obj.rect)
+        return obj
+
+    def add_collider(self, collider) -> None:
+        self.colliders.add(collider)
+
+    def remove_collider(self, collider) -> None:
+        collider.is_removed = True
+        self.colliders.remove(collider)
+
+    def remove_platform_collider(self, platform) -> None:
+        """
+        Takes a platform out of the collision data by only changing the colliders around it.
+        Merged colliders are the union of the platforms in them, so cutting the platform's rect out of them
+        and adding back the parts that other platforms still cover gives the right shape
+        """
+        if type(platform) is not Platform or platform.is_rotated:
+            self.remove_collider(platform)
+            return
+
+        hole = platform.rect
+        # The platform has already been taken out of object_index, so these are the other platforms
+        still_covered = [other.rect.clip(hole) for other in self.object_index.query(hole)
+                         if type(other) is Platform and not other.is_rotated and other.rect.colliderect(hole)]
+        self.merge_colliders_near(hole, still_covered, hole)
+
+    def merge_colliders_near(self, area: pygame.Rect, rects: list, hole: pygame.Rect = None) -> None:
+        """
+        Merges the static colliders in the grid cells that an edit touched again, together with some new rects.
+        Only those colliders are rebuilt, so an edit stays cheap, but editing doesn't keep splitting merged
+        colliders into more pieces (or add colliders that a merged one already covers)
+        :param area: The rect of the platform that was added or removed
+        :param rects: New rects to add to the colliders
+        :param hole: A rect to cut out of the existing colliders first
+        """
+        # 1 pixel bigger, so that colliders that only touch the edit (and could be joined to it) are included
+        for collider in self.collision_index.query(area.inflate(2, 2)):
+            if type(collider) is StaticCollider:
+                self.remove_collider(collider)
+                if hole is None:
+                    rects.append(collider.rect)
+                else:
+                    rects.extend(subtract_rect(collider.rect, hole))
+
+        for rect in merge_rects(rects):
+            self.add_collider(StaticCollider(rect))
+
+    def build_static_layer(self, size: tuple) -> pygame.Surface:
+        """
+        Draws every platform that never moves onto one surface, so they can be drawn with a single blit
+        """
+        self.static_layer = pygame.Surface(size, pygame.SRCALPHA)
+        for obj in list(self.all_platforms) + self.all_semi_solid_platforms:
+            if type(obj) is not MovingPlatform:
+                obj.draw(self.static_layer)
+        return self.static_layer
+
+    def redraw_static_layer(self, area: pygame.Rect) -> None:
+        """
+        Redraws only the part of the static layer that an edit changed
+        """
+        if self.static_layer is None:
+            return
+
+        self.static_layer.set_clip(area)
+        self.static_layer.fill((0, 0, 0, 0))
+        for obj in self.object_index.query(area):
+            if isinstance(obj, (Platform, SemiSolidPlatform)) and type(obj) is not MovingPlatform:
+                obj.draw(self.static_layer)
+        self.static_layer.set_clip(None)
+
+        if self.on_static_layer_redrawn is not None:
+            self.on_static_layer_redrawn(area)
+
+    #### Editing API ####
+    def apply(self, object_id: int, kind: str, line, obj=None):
+        """
+        Replaces whatever has this ID with the object described by line (or removes it if line is None)
+        :param kind: "E" for enemies, "P" for platforms
+        :param obj: The object to use, if it has already been made
+        :return: The new object
+        """
+        if object_id in self.objects:
+            self.remove_object(object_id)
+
+        if line is None:
+            return None
+
+        if obj is None:
+            split_data = line.split()
+            obj = self.enemy_from_line(split_data) if kind == "E" else self.platform_from_line(split_data)
+
+        self.add_object(object_id, kind, obj)
+        return obj
+
+    def edit(self, object_id: int, kind: str, before, after, obj=None):
+        """
+        Applies an edit, records it for undo and appends it to the journal
+        """
+        obj = self.apply(object_id, kind, after, obj)
+        self.undo_stack.append((object_id, kind, before, after))
+        self.redo_stack.clear()
+        self.write_journal(object_id, kind, after)
+        return obj
+
+    def write_journal(self, object_id: int, kind: str, line) -> None:
+        with open(self.journal_path, "at") as journal:
+            journal.write(str(object_id) + " " + kind + " " + ("-" if line is None else line) + "\n")
+
+    def line_of(self, obj) -> tuple:
+        """
+        :return: The ID, kind and file line of an object in the level
+        """
+        if isinstance(obj, (Platform, SemiSolidPlatform)):
+            return self.ids[obj], "P", self.platform_to_line(obj)
+        return self.ids[obj], "E", self.enemy_to_line(obj)
+
+    def add_platform(self, platform):
+        self.next_id += 1
+        return self.edit(self.next_id - 1, "P", None, self.platform_to_line(platform), platform)
+
+    def add_enemy(self, enemy):
+        self.next_id += 1
+        return self.edit(self.next_id - 1, "E", None, self.enemy_to_line(enemy), enemy)
+
+    def move(self, obj, dx: int, dy: int):
+        """
+        Moves a platform or enemy (for moving platforms, the whole path is moved)
+        :return: The moved object (it will be a new object)
+        """
+        object_id, kind, line = self.line_of(obj)
+        split_data = line.split()
+        if kind == "E":
+            positions = [1]
+        elif split_data[0] == "01":
+            positions = [4, 6]
+        else:
+            positions = [4]
+
+        for i in positions:
+            split_data[i] = str(int(split_data[i]) + dx)
+            split_data[i + 1] = str(int(split_data[i + 1]) + dy)
+
+        return self.edit(object_id, kind, line, " ".join(split_data))
+
+    def resize(self, platform, width: int, height: int):
+        """
+        :return: The resized platform (it will be a new object)
+        """
+        object_id, kind, line = self.line_of(platform)
+        if kind != "P":
+            raise ValueError("Only platforms can be resized")
+
+        split_data = line.split()
+        split_data[1] = str(width)
+        split_data[2] = str(height)
+        return self.edit(object_id, kind, line, " ".join(split_data))
+
+    def delete(self, obj) -> None:
+        object_id, kind, line = self.line_of(obj)
+        self.edit(object_id, kind, line, None)
+
+    def undo(self) -> bool:
+        """
+        :return: False if there was nothing to undo
+        """
+        if not self.undo_stack:
+            return False
+
+        object_id, kind, before, after = self.undo_stack.pop()
+        self.apply(object_id, kind, before)
+        self.write_journal(object_id, kind, before)
+        self.redo_stack.append((object_id, kind, before, after))
+        return True
+
+    def redo(self) -> bool:
+        """
+        :return: False if there was nothing to redo
+        """
+        if not self.redo_stack:
+            return False
+
+        object_id, kind, before, after = self.redo_stack.pop()
+        self.apply(object_id, kind, after)
+        self.write_journal(object_id, kind, after)
+        self.undo_stack.append((object_id, kind, before, after))
+        return True
+
+    def objects_at(self, point: tuple) -> list:
+        """
+        :return: The platforms and enemies under a point (e.g. the mouse), for picking in an editor
+        """
+        return self.object_index.query_point(point)
+
+    def save(self) -> None:
+        """
+        Writes the whole level file again and clears the journal.
+        IDs are renumbered to match the order they will be loaded in
+        """
+        self.to_file(self.file_path)
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+
+        enemies, platforms = self.saved_objects()
+        ordered = enemies + platforms
+        self.objects = dict(enumerate(ordered))
+        self.ids = {obj: object_id for object_id, obj in self.objects.items()}
+        self.next_id = len(ordered)
+
+        # Old IDs in the history don't mean anything anymore
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    def saved_objects(self) -> tuple:
+        """
+        :return: (enemies, platforms) in the order they are written to the level file.
+        They come from the editor's registry rather than all_enemies, which loses enemies that die in the game
+        """
+        enemies = []
+        platforms = []
+        semi_solid_platforms = []
+        for obj in self.objects.values():
+            if type(obj) is SemiSolidPlatform:
+                semi_solid_platforms.append(obj)
+            elif isinstance(obj, Platform):
+                platforms.append(obj)
+            else:
+                enemies.append(obj)
+        return enemies, platforms + semi_solid_platforms
 
     def to_file(self, filePath) -> None:
         """
@@ -686,46 +1743,19 @@ class GameLevel:
         # Platforms: Type (solid, spikes, or semisolid), isMoving, width, height,
         # orientation, startPos, endPos (if moving)
 
+        enemies, platforms = self.saved_objects()
         with open(filePath, "wt") as myFile:
             # METADATA
             myFile.write(str(self.respawn_point[0]) + " ")
             myFile.write(str(self.respawn_point[1]) + " ")
             myFile.write(str(self.objectiveType) + " ")
-            myFile.write(str(len(self.all_enemies)) + " ")
-            noPlatforms = len(self.all_platforms) + len(self.all_semi_solid_platforms)
-            myFile.write(str(noPlatforms) + "\n")
+            myFile.write(str(len(enemies)) + " ")
+            myFile.write(str(len(platforms)) + "\n")
 
             # Enemy data (just enemy type + initialPos)
-            for enemy in self.all_enemies:
-                # Write the enemy type (already in bytes)
-                myFile.write(enemy.character_code + " ")
-                # Write the enemy data here
-                # For now, all enemies just have an initial position
-                myFile.write(str(enemy.rect.left) + " ")
-                myFile.write(str(enemy.rect.top) + "\n")
+            for enemy in enemies:
+                myFile.write(self.enemy_to_line(enemy) + "\n")
 
             # Platform data
-            for platform in self.all_platforms + self.all_semi_solid_platforms:
-                # There is no space after platform code on purpose
-                myFile.write(platform.code)
-
-
-                # Determine whether the platform is moving or not
-                isMoving = type(platform) is MovingPlatform
-                myFile.write(str(int(isMoving)) + " ")
-
-                # Write the dimensions, orientation and starting position
-                myFile.write(str(platform.rect.width) + " " + str(platform.rect.height) + " ")
-                myFile.write(str(platform.orientation) + " ")
-                myFile.write(str(platform.rect.left) + " " + str(platform.rect.top) + " ")
-
-                if isMoving:
-                    # Write the end positions of the platforms as well
-                    myFile.write(str(platform.path[1][0]) + " " +
-                                 str(platform.path[1][1]) + "\n")
-
-                else:
-                    # If it is not finished
-                    myFile.write("\n")
-
-
+            for platform in platforms:
+                myFile.write(self.platform_to_line(platform) + "\n")
@@ -0,0 +1,238 @@
+"""
+Offline level checker for the content pipeline.
+It simulates the player (normal jumps, high jumps and ground pounds, with the real Player physics)
+from positions sampled along every walkable surface, and builds a reachability graph of surfaces.
+It then reports surfaces that can't be reached from the start point, and ones that can only be reached
+by taking damage from spikes.
+The simulations are split across a process pool, and results are cached per level hash.
+Usage: python levelAnalyser.py level.gdt [--workers N] [--start x y]
+(the start point is the top left of the player, and defaults to the respawn point used by main.py)
+Enemies are ignored, and moving platforms are treated as if they stay at their starting position.
+"""
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# Bump this whenever the simulation changes, so old cached results aren't used
+ANALYSER_VERSION = 3
+CACHE_FOLDER = ".levelcache"
+
+# Same as main.py: the player can't leave the sides of the screen, and falls to its death below it
+SCREEN_SIZE = (400, 400)
+PLAYER_SIZE = (32, 32)
+PLAYER_START = (60, 100)  # Top left of the player when it (re)spawns
+SAMPLE_SPACING = 16
+MAX_FRAMES = 240
+FRAME_TIME = 16  # Milliseconds, for the ground pound animation
+
+
+class FakeClock:
+    """
+    Stands in for pygame.time.Clock in the simulation, which runs faster than real time
+    """
+    @staticmethod
+    def get_time() -> int:
+        return FRAME_TIME
+
+
+# Each strategy is (direction held, jump type, ground pound at the top of the arc)
+STRATEGIES = [(direction, jump, ground_pound)
+              for direction in (-1, 0, 1)
+              for jump in (None, "jump", "high jump")
+              for ground_pound in (False, True)]
+
+# State of each worker process, set up by init_worker()
+worker = {}
+
+
+def init_worker(level_path: str) -> None:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+    from gameClasses import GameLevel, Player
+    from navigation import NavigationGraph
+
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))  # Sprites need a display mode to convert their images
+    level = GameLevel(level_path)
+    worker["pygame"] = pygame
+    worker["Player"] = Player
+    worker["level"] = level
+    worker["graph"] = NavigationGraph(level, character_size=PLAYER_SIZE)
+    # Surfaces are referred to by their position in graph.surfaces, looked up here on every landing
+    worker["surface_numbers"] = {surface: i for i, surface in enumerate(worker["graph"].surfaces)}
+
+
+def simulate(surface, x: int, strategy: tuple) -> tuple:
+    """
+    Runs the player from a standing position until it lands on a different surface
+    :return: (index of the surface landed on or None, whether the player took damage)
+    """
+    Player = worker["Player"]
+    level = worker["level"]
+    graph = worker["graph"]
+    direction, jump, ground_pound = strategy
+
+    player = Player(PLAYER_SIZE, (0, 0, 255), worker["pygame"].USEREVENT + 1, (0, 0))
+    player.rect.midbottom = (x, surface.y)
+    player.float_pos.update(player.rect.topleft)
+    player.isGrounded = True
+    start_health = player.health
+    has_left_ground = False
+
+    for frame in range(MAX_FRAMES):
+        # The same order as simulate_frame in main.py
+        player.handle_input(left=direction < 0, right=direction > 0,
+                            jump=jump is not None and not has_left_ground, highJump=jump == "high jump")
+
+        if ground_pound and has_left_ground and player.ySpeed >= 0:
+            player.start_ground_pound()
+
+        if player.rect.x > SCREEN_SIZE[0] - player.rect.width:
+            player.float_pos.x = SCREEN_SIZE[0] - player.rect.width
+            player.xSpeed = 0
+        elif player.rect.x < 0:
+            player.float_pos.x = 0
+            player.xSpeed = 0
+
+        if player.rect.y > SCREEN_SIZE[1]:
+            # Fell off the level
+            return None, player.health < start_health
+
+        if player.isSpinning:
+            player.ground_pound(FakeClock)
+
+        player.float_pos.x += player.xSpeed
+        player.float_pos.y += player.ySpeed
+        player.rect.x = round(player.float_pos.x)
+        player.rect.y = round(player.float_pos.y)
+        player.collision_update(level.colliders, level.all_semi_solid_platforms)
+
+        if not player.isGrounded and player.ySpeed != 0:
+            has_left_ground = True
+
+        elif player.isGrounded and has_left_ground:
+            landed_on = graph.surface_under((player.rect.centerx, player.rect.bottom - 2), max_depth=4)
+            if landed_on is not None and landed_on is not surface:
+                return worker["surface_numbers"][landed_on], player.health < start_health
+            has_left_ground = False
+
+    return None, player.health < start_health
+
+
+def explore_surface(index: int) -> list:
+    """
+    Work for one process: tries every strategy from sample points along one surface
+    :return: A list of [target surface, took damage] edges (without duplicates)
+    """
+    surface = worker["graph"].surfaces[index]
+    half_width = PLAYER_SIZE[0] // 2
+    samples = list(range(surface.left + half_width, surface.right - half_width + 1, SAMPLE_SPACING))
+    if surface.right - half_width not in samples:
+        samples.append(surface.right - half_width)
+
+    edges = {}
+    for x in samples:
+        for strategy in STRATEGIES:
+            target, damaged = simulate(surface, x, strategy)
+            if target is not None:
+                # Keep the safe way of getting there if there is one
+                edges[target] = edges.get(target, True) and damaged
+
+    return [[target, damaged] for target, damaged in edges.items()]
+
+
+def level_hash(level_path: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(str((ANALYSER_VERSION, SCREEN_SIZE, PLAYER_SIZE, SAMPLE_SPACING, MAX_FRAMES)).encode())
+    for path in (level_path, level_path + ".edits"):
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                digest.update(file.read())
+    return digest.hexdigest()
+
+
+def build_reachability(level_path: str, workers: int = None) -> dict:
+    """
+    :return: {"surfaces": [[left, right, y], ...], "edges": {source index: [[target index, took damage], ...]}}
+    """
+    cache_path = os.path.join(CACHE_FOLDER, level_hash(level_path) + ".json")
+    if os.path.exists(cache_path):
+        with open(cache_path, "rt") as file:
+            return json.load(file)
+
+    # The main process needs the surfaces too, to hand out the work and write the report
+    init_worker(level_path)
+    surfaces = worker["graph"].surfaces
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(level_path,)) as pool:
+        results = list(pool.map(explore_surface, range(len(surfaces)), chunksize=4))
+
+    graph = {
+        "surfaces": [[surface.left, surface.right, surface.y] for surface in surfaces],
+        "edges": {str(index): edges for index, edges in enumerate(results)}
+    }
+
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    with open(cache_path, "wt") as file:
+        json.dump(graph, file)
+    return graph
+
+
+def analyse(graph: dict, start: int) -> tuple:
+    """
+    :param start: The index of the surface the player starts on
+    :return: (surfaces that can't be reached, surfaces that can only be reached by taking damage)
+    """
+    def reachable(allow_damage: bool) -> set:
+        seen = {start}
+        to_visit = [start]
+        while to_visit:
+            source = to_visit.pop()
+            for target, damaged in graph["edges"][str(source)]:
+                if target not in seen and (allow_damage or not damaged):
+                    seen.add(target)
+                    to_visit.append(target)
+        return seen
+
+    safe = reachable(allow_damage=False)
+    everything = reachable(allow_damage=True)
+    all_surfaces = set(range(len(graph["surfaces"])))
+    return sorted(all_surfaces - everything), sorted(everything - safe)
+
+
+def main(args: list) -> int:
+    level_path = args[0]
+    workers = int(args[args.index("--workers") + 1]) if "--workers" in args else None
+
+    graph = build_reachability(level_path, workers)
+    if not worker:
+        # The results came from the cache, but the start surface still has to be found
+        init_worker(level_path)
+
+    start_point = PLAYER_START
+    if "--start" in args:
+        start_point = (int(args[args.index("--start") + 1]), int(args[args.index("--start") + 2]))
+
+    # The player falls from the start point onto the first surface under its bottom middle
+    start_surface = worker["graph"].surface_under((start_point[0] + PLAYER_SIZE[0] // 2,
+                                                   start_point[1] + PLAYER_SIZE[1]))
+    if start_surface is None:
+        print("There is no surface under the start point " + str(start_point))
+        return 1
+
+    unreachable, forced_damage = analyse(graph, worker["surface_numbers"][start_surface])
+    surfaces = graph["surfaces"]
+    print(str(len(surfaces)) + " surfaces checked")
+    for title, found in (("Unreachable", unreachable), ("Only reachable by taking damage", forced_damage)):
+        print(title + ": " + str(len(found)))
+        for index in found:
+            left, right, y = surfaces[index]
+            print("  x " + str(left) + " to " + str(right) + " at y " + str(y))
+
+    return 1 if unreachable or forced_damage else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,8 +1,21 @@
+import queue
 import sys
-from pygame.constants import *
-from gameClasses import *
+import threading
+import time
+import weakref
+
+STARTUP_BEGIN = time.perf_counter()
 
-pygame.init()
+import pygame
+from pygame.constants import *
+from gameClasses import (CollisionCharacter, Player, Fool, JumpingFool, HunterFool, GhostPursuer,
+                         GameLevel)
+from allocationAudit import AllocationAudit
+from frameGovernor import FrameGovernor
+from pipeline import FrameBuffer
+
+# Only start the parts of pygame the game uses (the display also gives us events and the keyboard)
+pygame.display.init()
 SCREENWIDTH = 400
 SCREENHEIGHT = 400
 FPS = 60
@@ -21,18 +34,6 @@ pygame.display.set_caption("Game")
 # Set up game stuff here
 player_is_invulnerable = pygame.USEREVENT + 1
 player = Player((32, 32), BLUE, player_is_invulnerable, (40, 200))
-platform = Platform((408, 200), GREEN, (-4, 300))
-wall = Platform((30, SCREENHEIGHT), GREEN, (0, 0))
-wall2 = Platform((30, SCREENHEIGHT), GREEN, (SCREENWIDTH-10, 0))
-platform3 = MovingPlatform((80, 15), GREEN, (210, 210), (300, 210))
-platform4 = SemiSolidPlatform((80, 10), (60, 210))
-
-spikes = Spikes(8, 20, (150, 100), 0)
-
-fool1 = JumpingFool((180, 101))
-pursuer1 = GhostPursuer((10, 90))
-all_enemies = pygame.sprite.Group()
-all_enemies.add(pursuer1, fool1)
 
 respawn_point = (60, 100)
 
@@ -41,112 +42,256 @@ playerHealthIcon = pygame.transform.scale(player.image, (15, 15))
 clock = pygame.time.Clock()
 
 game_is_running = True
+audit = AllocationAudit(enabled="--audit-allocations" in sys.argv)
+# The governor lowers the quality when frames go over budget. It only measures the normal loop, and is left
+# off while auditing so that the allocations aren't changed by the quality tier
+governor = FrameGovernor(1000 / FPS, enabled="--fixed-quality" not in sys.argv and
+                         "--pipelined" not in sys.argv and not audit.enabled)
 level1 = GameLevel("level.gdt")
 
-all_platforms = level1.all_platforms
+colliders = level1.colliders
+moving_platforms = level1.moving_platforms
 all_semi_solid_platforms = level1.all_semi_solid_platforms
 all_enemies = level1.all_enemies
+level1.build_static_layer((SCREENWIDTH, SCREENHEIGHT))
+print("Colliders: " + str(level1.collider_count_before) + " platforms merged into " +
+      str(level1.collider_count_after))
+
+# Used to draw at half resolution when the governor asks for it
+low_res_canvas = pygame.Surface((SCREENWIDTH // 2, SCREENHEIGHT // 2))
+low_res_images = weakref.WeakKeyDictionary()
+
+def forget_low_res_static_layer(area: pygame.Rect):
+    # The static layer is the one image that is changed in place (when the level is edited)
+    low_res_images.pop(level1.static_layer, None)
+
+level1.on_static_layer_redrawn = forget_low_res_static_layer
+
+# The navigation graph is only needed by hunters, and is built after the first frame is on screen
+navigation = None
+
+def player_hits_fool(player, enemy):
+    if enemy.isBeingSquished:
+        return
+
+    enemy.wake()
+    player.wake()
+    # Now check for where player position is relative to enemy
+    # If the player is above the enemy's centre
+    if player.rect.bottomleft[1] <= enemy.rect.centery and player.ySpeed > 0:
+        enemy.isBeingSquished = True
+        player.ySpeed = -5
+        if type(enemy) is JumpingFool:
+            enemy.kill()
+            broadphase.remove(enemy)
+
+    elif player.iframes_left == 0:
+        player.take_damage()
+
+def player_hits_ghost(player, enemy):
+    if player.iframes_left == 0:
+        player.take_damage()
+        enemy.kill()
+        broadphase.remove(enemy)
+
+def fools_bounce(fool_a, fool_b):
+    """
+    Fools walking into each other both turn around
+    """
+    if fool_a.isBeingSquished or fool_b.isBeingSquished:
+        return
+
+    left_fool, right_fool = sorted((fool_a, fool_b), key=lambda fool: fool.rect.centerx)
+    left_fool.on_left_collision()
+    right_fool.on_right_collision()
+    left_fool.wake()
+    right_fool.wake()
+
+# The broadphase finds which entities overlap, and the handlers decide what happens to them.
+# The level already has its enemies in it (and keeps it up to date when they are edited)
+broadphase = level1.broadphase
+broadphase.add(player)
+
+broadphase.register_handler(Player, Fool, player_hits_fool)
+broadphase.register_handler(Player, JumpingFool, player_hits_fool)
+broadphase.register_handler(Player, HunterFool, player_hits_fool)
+broadphase.register_handler(Player, GhostPursuer, player_hits_ghost)
+broadphase.register_handler(Fool, Fool, fools_bounce)
+broadphase.register_handler(Fool, JumpingFool, fools_bounce)
+broadphase.register_handler(JumpingFool, JumpingFool, fools_bounce)
+broadphase.register_handler(HunterFool, HunterFool, fools_bounce)
+broadphase.register_handler(Fool, HunterFool, fools_bounce)
+broadphase.register_handler(JumpingFool, HunterFool, fools_bounce)
+
+def begin_phase(phase: str):
+    audit.begin(phase)
+    governor.begin(phase)
+
+def end_phase():
+    audit.end()
+    governor.end()
 
 def enemy_logic():
+    screen_rect = screen.get_rect()
+    update_offscreen = governor.should_update_offscreen()
     for enemy in all_enemies:
-        if type(enemy) is Fool or type(enemy) is JumpingFool:
+        if not update_offscreen and not screen_rect.colliderect(enemy.rect):
+            continue
+
+        if type(enemy) is Fool or type(enemy) is JumpingFool or type(enemy) is HunterFool:
             # Logic for fools - check the fool class
             if not enemy.isBeingSquished:
-                enemy.update(all_platforms, all_semi_solid_platforms)
-
-                # Check for collision with player
-                if enemy.rect.colliderect(player.rect):
-                    # Now check for where player position is relative to enemy
-                    # If the player is above the enemy's centre
-                    if player.rect.bottomleft[1] <= enemy.rect.centery and player.ySpeed > 0:
-                        enemy.isBeingSquished = True
-                        player.ySpeed = -5
-                        if type(enemy) is JumpingFool:
-                            enemy.kill()
-
-                    elif player.iframes_left == 0:
-                        player.take_damage()
+                if type(enemy) is HunterFool:
+                    enemy.update(colliders, all_semi_solid_platforms, navigation, player.rect.midbottom)
+                else:
+                    enemy.update(colliders, all_semi_solid_platforms)
 
             else:
-                if type(enemy) is Fool:
+                if type(enemy) is Fool or type(enemy) is HunterFool:
                     enemy.internal_timer += clock.get_time()
                     if enemy.internal_timer >= 20:
                         enemy.become_squished()
                         enemy.internal_timer = 0
+                        if not enemy.alive():
+                            broadphase.remove(enemy)
 
         if type(enemy) is GhostPursuer:
             enemy.update(player.rect.center)
-            if player.rect.colliderect(enemy.collision_rect) and player.iframes_left == 0:
-                player.take_damage()
-                enemy.kill()
 
-def display_graphics():
-    # First clear the canvas
-    screen.fill("0xFFFFFF")
+    # Interactions between the player and the enemies, and between enemies themselves
+    broadphase.dispatch()
 
-    # Now draw all the platforms
-    for obj in all_platforms + all_semi_solid_platforms:
-        obj.draw(screen)
+def wake_characters_near(platform):
+    """
+    Wakes up any sleeping characters that a moving platform could push or carry
+    """
+    area = platform.rect.inflate(2, 2)
+    if player.rect.colliderect(area):
+        player.wake()
 
-    # And all the enemies
     for enemy in all_enemies:
-        enemy.draw(screen)
-
-    for i in range(player.health):
-        screen.blit(playerHealthIcon, (30 + i*30, 10))
+        if isinstance(enemy, CollisionCharacter) and enemy.rect.colliderect(area):
+            enemy.wake()
+
+def take_snapshot() -> tuple:
+    """
+    Copies everything display_snapshot needs into an immutable snapshot, so a frame can be drawn
+    while the next one is being simulated.
+    Images can be shared because they are never changed in place (e.g. rotating the player makes a new surface)
+    """
+    platforms = tuple((obj.image, obj.rect.topleft) for obj in moving_platforms)
+    enemies = tuple((enemy.image, enemy.rect.topleft) for enemy in all_enemies)
+    player_sprite = None if player.is_invisible else (player.image, player.rect.topleft)
+    return platforms, enemies, player.health, player_sprite
+
+def draw_scaled(canvas: pygame.Surface, image: pygame.Surface, position, scale: float):
+    if scale == 1:
+        canvas.blit(image, position)
+        return
+
+    # Images are never changed in place (apart from the static layer, which clears its copy when it is redrawn),
+    # so each one only has to be scaled once
+    small_image = low_res_images.get(image)
+    if small_image is None:
+        small_image = pygame.transform.scale_by(image, scale)
+        low_res_images[image] = small_image
+    canvas.blit(small_image, (position[0] * scale, position[1] * scale))
+
+def start_drawing(scale: float) -> pygame.Surface:
+    """
+    Clears the canvas for this frame and draws the platforms that never move
+    :return: The surface to draw the rest of the frame on
+    """
+    canvas = screen if scale == 1 else low_res_canvas
+    canvas.fill("0xFFFFFF")
+
+    # The platforms that never move are already drawn on the static layer
+    draw_scaled(canvas, level1.static_layer, (0, 0), scale)
+    return canvas
+
+def draw_health(canvas: pygame.Surface, health: int, scale: float):
+    if governor.show_health_icons:
+        for i in range(health):
+            draw_scaled(canvas, playerHealthIcon, (30 + i*30, 10), scale)
+
+def finish_drawing(canvas: pygame.Surface):
+    if canvas is not screen:
+        pygame.transform.scale(canvas, (SCREENWIDTH, SCREENHEIGHT), screen)
 
-    # And the player
-    player.draw(screen)
-
-
-#### Main game logic ####
-while game_is_running:
-    # Event stuff
-    keys = pygame.key.get_pressed()
-    for event in pygame.event.get():
-        if event.type == QUIT or player.health <= 0:
-            game_is_running = False
-
-        elif event.type == player_is_invulnerable:
-            player.iframes_left -= 1
-            player.is_invisible = not player.is_invisible
-
-        elif event.type == KEYDOWN:
-            if event.key == K_c:
-                if not player.isGrounded and not player.isSpinning and player.canGroundPound:
-                    player.isSpinning = True
-                    player.rotate(3.6)
-            elif event.key == K_0:
-                pygame.display.toggle_fullscreen()
+def display_graphics():
+    """
+    Draws the game straight from the sprites (used by the normal loop, so no snapshot is needed)
+    """
+    scale = governor.render_scale
+    canvas = start_drawing(scale)
+
+    # Now draw the moving platforms and all the enemies
+    for obj in moving_platforms:
+        draw_scaled(canvas, obj.image, obj.rect, scale)
+    for enemy in all_enemies:
+        draw_scaled(canvas, enemy.image, enemy.rect, scale)
 
+    draw_health(canvas, player.health, scale)
 
+    # And the player
+    if not player.is_invisible:
+        draw_scaled(canvas, player.image, player.rect, scale)
+
+    finish_drawing(canvas)
+
+def display_snapshot(snapshot: tuple):
+    """
+    Draws a snapshot from take_snapshot() (used by the render thread in pipelined mode)
+    """
+    platforms, enemies, health, player_sprite = snapshot
+    scale = governor.render_scale
+    canvas = start_drawing(scale)
+
+    for image, position in platforms:
+        draw_scaled(canvas, image, position, scale)
+    for image, position in enemies:
+        draw_scaled(canvas, image, position, scale)
+
+    draw_health(canvas, health, scale)
+
+    if player_sprite is not None:
+        draw_scaled(canvas, *player_sprite, scale)
+
+    finish_drawing(canvas)
+
+def handle_display_event(event) -> bool:
+    """
+    Events that have to be dealt with on the main thread
+    :return: True if the event was used
+    """
+    if event.type == KEYDOWN and event.key == K_0:
+        pygame.display.toggle_fullscreen()
+        return True
+    return False
+
+def handle_game_event(event):
+    global game_is_running
+    if event.type == QUIT or player.health <= 0:
+        game_is_running = False
+
+    elif event.type == player_is_invulnerable:
+        player.iframes_left -= 1
+        player.is_invisible = not player.is_invisible
+
+    elif event.type == KEYDOWN:
+        if event.key == K_c:
+            player.start_ground_pound()
+
+def simulate_frame(keys, mods):
+    """
+    Runs one frame of the game (everything apart from events and drawing)
+    """
     #### Player controls ####
-    if keys[pygame.K_LEFT] or keys[pygame.K_a]:
-        if not player.isGrounded:
-            player.xSpeed -= 0.2
-        else:
-            player.xSpeed -= 1
-
-        # We do not want to accelerate past our max speed
-        if player.xSpeed < -1 * player.max_horizontal_speed:
-            player.xSpeed = -player.max_horizontal_speed
-
-    elif keys[pygame.K_RIGHT] or keys[pygame.K_d]:
-        if not player.isGrounded:
-            player.xSpeed += 0.2
-        else:
-            player.xSpeed += 1
-
-        if player.xSpeed > player.max_horizontal_speed:
-            player.xSpeed = player.max_horizontal_speed
-
-    # If neither the left/A nor the right/D key is pressed
-    else:
-        player.decelerate()
-
-    if keys[pygame.K_SPACE]:
-        player.jump(highJump=pygame.key.get_mods() & KMOD_SHIFT)
-
+    begin_phase("player controls")
+    player.handle_input(left=keys[pygame.K_LEFT] or keys[pygame.K_a],
+                        right=keys[pygame.K_RIGHT] or keys[pygame.K_d],
+                        jump=keys[pygame.K_SPACE],
+                        highJump=mods & KMOD_SHIFT)
 
     # Prevents the player moving off-screen
     if player.rect.x > SCREENWIDTH - player.rect.width:
@@ -161,6 +306,7 @@ while game_is_running:
         player.rect.topleft = respawn_point
         player.float_pos.x = player.rect.centerx
         player.float_pos.y = player.rect.centery
+        player.wake()
         player.take_damage()
 
 
@@ -173,22 +319,126 @@ while game_is_running:
     player.rect.x = round(player.float_pos.x)
     player.rect.y = round(player.float_pos.y)
 
+    end_phase()
+
     #### Enemy logic ####
+    begin_phase("enemies")
     enemy_logic()
+    end_phase()
 
     #### Collision detection ####
-    player.collision_update(all_platforms, all_semi_solid_platforms)
+    begin_phase("player collision")
+    player.collision_update(colliders, all_semi_solid_platforms)
+    end_phase()
+
+    begin_phase("moving platforms")
+    colliders.update_moving(clock)
+    for obj in moving_platforms:
+        if obj.velocity.length_squared() != 0:
+            wake_characters_near(obj)
+    if navigation is not None:
+        navigation.refresh_moving()
+    end_phase()
+
+def run_pipelined():
+    """
+    Runs the simulation on its own thread while this (main) thread handles events and draws.
+    pygame needs events and the display to be used from the main thread, so inputs are passed to the
+    simulation thread, and it passes back immutable snapshots through a FrameBuffer
+    """
+    global latest_input
+    frames = FrameBuffer()
+    game_events = queue.SimpleQueue()
+    latest_input = (pygame.key.get_pressed(), pygame.key.get_mods())
+
+    simulation_errors = []
+
+    def simulation_loop():
+        global game_is_running
+        try:
+            while game_is_running:
+                while not game_events.empty():
+                    handle_game_event(game_events.get())
+
+                # Replacing latest_input is a single assignment, so this always sees a whole (keys, mods) pair
+                keys, mods = latest_input
+                simulate_frame(keys, mods)
+                frames.publish(take_snapshot())
+                clock.tick(FPS)
+        except BaseException as error:
+            # Passed back to the main thread, which raises it again once it stops drawing
+            simulation_errors.append(error)
+        finally:
+            # Stop the main thread too, otherwise it would keep drawing the last frame and nothing
+            # would read the QUIT event any more
+            game_is_running = False
+            frames.close()
+
+    simulation = threading.Thread(target=simulation_loop, daemon=True)
+    simulation.start()
+
+    last_frame = 0
+    while game_is_running:
+        latest_input = (pygame.key.get_pressed(), pygame.key.get_mods())
+        for event in pygame.event.get():
+            if not handle_display_event(event):
+                game_events.put(event)
+
+        last_frame, snapshot = frames.wait_for_frame(last_frame, timeout=0.1)
+        if snapshot is not None:
+            display_snapshot(snapshot)
+            pygame.display.flip()
 
-    for obj in all_platforms:
-        if type(obj) is MovingPlatform:
-            obj.update(clock)
+    simulation.join()
+    if simulation_errors:
+        raise simulation_errors[0]
 
+
+# Get the first frame on screen before doing anything that isn't needed for it
+display_graphics()
+pygame.display.flip()
+if "--first-frame-only" in sys.argv:
+    # Used by startupTiming.py, which reads this line
+    print("First frame: " + str(round((time.perf_counter() - STARTUP_BEGIN) * 1000)) + " ms")
+    pygame.quit()
+    sys.exit()
+
+if any(type(enemy) is HunterFool for enemy in all_enemies):
+    from navigation import NavigationGraph
+    navigation = NavigationGraph(level1, character_size=(20, 20), horizontal_speed=HunterFool.SPEED)
+
+#### Main game logic ####
+# --pipelined runs the simulation and the drawing on separate threads.
+# The allocation audit can't tell the two threads apart, so it always uses the normal loop
+if "--pipelined" in sys.argv and not audit.enabled:
+    run_pipelined()
+
+while game_is_running:
+    # Event stuff
+    begin_phase("events")
+    keys = pygame.key.get_pressed()
+    for event in pygame.event.get():
+        if not handle_display_event(event):
+            handle_game_event(event)
+    end_phase()
+
+    simulate_frame(keys, pygame.key.get_mods())
+
+    begin_phase("rendering")
     display_graphics()
 
     # Update the screen
     pygame.display.flip()
+    end_phase()
+    audit.end_frame()
+    governor.end_frame()
     clock.tick(FPS)
 
 # If the game is stopped
+if audit.enabled:
+    print(audit.report())
+if "--governor-stats" in sys.argv:
+    print(governor.report())
+
 pygame.quit()
 sys.exit()
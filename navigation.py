@@ -0,0 +1,370 @@
+import heapq
+from bisect import bisect_left
+
+import pygame
+
+from gameClasses import Player, Spikes, SemiSolidPlatform, SpatialGrid
+
+WALK = "walk"
+FALL = "fall"
+JUMP = "jump"
+HIGH_JUMP = "high jump"
+
+
+class WalkableSurface:
+    """
+    A node of the navigation graph: a horizontal stretch of floor that a character can stand on
+    """
+    def __init__(self, left: int, right: int, y: int, platform):
+        self.left = left
+        self.right = right
+        self.y = y
+        self.platform = platform
+        self.edges: list = []
+        # A thin rect along the floor, used to store the surface in a SpatialGrid
+        self.rect = pygame.Rect(left, y, max(right - left, 1), 1)
+
+    def gap_to(self, other) -> int:
+        """
+        :return: The horizontal gap between two surfaces (0 if they overlap)
+        """
+        return max(0, other.left - self.right, self.left - other.right)
+
+
+class NavigationEdge:
+    def __init__(self, source: WalkableSurface, target: WalkableSurface, kind: str,
+                 takeoff_x: float, landing_x: float, cost: float):
+        """
+        :param kind: WALK, FALL, JUMP or HIGH_JUMP
+        :param takeoff_x: The x coordinate (of the character's centre) to leave the source surface from
+        :param landing_x: The x coordinate to aim for on the target surface
+        :param cost: Roughly how many frames the move takes
+        """
+        self.source = source
+        self.target = target
+        self.kind = kind
+        self.takeoff_x = takeoff_x
+        self.landing_x = landing_x
+        self.cost = cost
+
+
+class Arc:
+    """
+    The height of a jump or fall on each frame, using the same physics as Player.jump and Player.fall:
+    the character moves by ySpeed, then gravity is added to ySpeed up to the maximum vertical speed
+    """
+    def __init__(self, initial_speed: float, max_speed: float, max_frames: int):
+        self.heights = []
+        y = 0
+        speed = initial_speed
+        for frame in range(max_frames):
+            y += speed
+            self.heights.append(y)
+            speed = min(speed + Player.GRAVITY, max_speed)
+
+        # The highest point (heights are negative going up) and the frame it is reached
+        self.apex_frame = min(range(max_frames), key=lambda frame: self.heights[frame])
+        self.apex = self.heights[self.apex_frame]
+        # After the apex the character only goes down, so this part is sorted
+        self.descent = self.heights[self.apex_frame:]
+
+    def landing_frame(self, drop: float):
+        """
+        :param drop: How far below the take-off height the landing surface is (negative if it is higher)
+        :return: The frame the character comes down onto that height, or None if the arc never gets there
+        """
+        if drop < self.apex:
+            return None
+
+        index = bisect_left(self.descent, drop)
+        if index == len(self.descent):
+            return None
+        return self.apex_frame + index + 1
+
+
+class NavigationGraph:
+    """
+    A graph of walkable surfaces for enemy AI, built once per level.
+    Edges are walks, falls and jumps, worked out from Player's jump physics. To keep building fast,
+    jumps only check that the arc can reach the other surface, not whether a wall is in the way;
+    enemies plan again every few frames, so they can cope if a jump doesn't work.
+    Paths are found with A* and cached. Surfaces on moving platforms are refreshed (and the cached
+    paths that use them thrown away) once the platform has moved far enough.
+    """
+    def __init__(self, level, character_size: tuple = (20, 20),
+                 horizontal_speed: float = Player.MAX_HORIZONTAL_SPEED, max_frames: int = 90,
+                 refresh_distance: int = 16):
+        """
+        :param level: The GameLevel to build the graph for
+        :param character_size: The size of the characters that will use the graph
+        :param horizontal_speed: How fast those characters move sideways in the air
+        :param max_frames: The longest jump or fall (in frames) that is considered
+        :param refresh_distance: How far a moving platform can move before its edges are worked out again
+        """
+        self.level = level
+        self.character_width, self.character_height = character_size
+        self.horizontal_speed = horizontal_speed
+        self.refresh_distance = refresh_distance
+
+        self.arcs = {
+            FALL: Arc(0, Player.JUMP_SPEED, max_frames),
+            JUMP: Arc(-Player.JUMP_SPEED, Player.JUMP_SPEED, max_frames),
+            HIGH_JUMP: Arc(-Player.HIGH_JUMP_SPEED, Player.HIGH_JUMP_SPEED, max_frames)
+        }
+        # The furthest any edge can reach, used to limit which surfaces are checked
+        self.max_reach = horizontal_speed * max_frames
+        self.max_rise = -min(arc.apex for arc in self.arcs.values())
+        self.max_drop = max(arc.heights[-1] for arc in self.arcs.values())
+
+        self.surfaces: list = []
+        self.surface_index = SpatialGrid(cell_size=128)
+        self.moving_surfaces: dict = {}  # surface: the platform position it was built at
+
+        # Path cache: (start, goal): list of edges (or None if there is no path)
+        self.path_cache: dict = {}
+        self.cache_keys_by_surface: dict = {}  # surface: keys of the cached paths that go through it
+
+        self.build()
+
+    #### Building ####
+    def build(self) -> None:
+        blockers = SpatialGrid()
+        for collider in self.level.all_colliders:
+            blockers.insert(collider)
+
+        # Static solid floors (spikes are left out because enemies shouldn't path over them)
+        for collider in self.level.all_colliders:
+            if type(collider) is Spikes or collider.is_rotated:
+                continue
+            for left, right in self.free_stretches(collider, blockers):
+                self.add_surface(WalkableSurface(left, right, collider.rect.top, collider))
+
+        for platform in self.level.all_semi_solid_platforms:
+            for left, right in self.free_stretches(platform, blockers):
+                self.add_surface(WalkableSurface(left, right, platform.rect.top, platform))
+
+        for platform in self.level.moving_platforms:
+            surface = WalkableSurface(platform.rect.left, platform.rect.right, platform.rect.top, platform)
+            self.add_surface(surface)
+            self.moving_surfaces[surface] = platform.rect.topleft
+
+        for surface in self.surfaces:
+            self.connect(surface)
+
+    def free_stretches(self, platform, blockers: SpatialGrid) -> list:
+        """
+        :return: The (left, right) parts of a platform's top that have room above them for a character
+        """
+        headroom = pygame.Rect(platform.rect.left, platform.rect.top - self.character_height,
+                               platform.rect.width, self.character_height)
+        stretches = [(platform.rect.left, platform.rect.right)]
+        for blocker in blockers.query(headroom):
+            if blocker is platform or not blocker.rect.colliderect(headroom):
+                continue
+
+            new_stretches = []
+            for left, right in stretches:
+                if blocker.rect.left > left:
+                    new_stretches.append((left, min(right, blocker.rect.left)))
+                if blocker.rect.right < right:
+                    new_stretches.append((max(left, blocker.rect.right), right))
+            stretches = new_stretches
+
+        return [(left, right) for left, right in stretches if right - left >= self.character_width]
+
+    def add_surface(self, surface: WalkableSurface) -> None:
+        self.surfaces.append(surface)
+        self.surface_index.insert(surface)
+
+    def nearby_surfaces(self, surface: WalkableSurface) -> list:
+        area = pygame.Rect(surface.left - self.max_reach, surface.y - self.max_rise,
+                           surface.right - surface.left + 2 * self.max_reach, self.max_rise + self.max_drop)
+        return self.surface_index.query(area)
+
+    def connect(self, source: WalkableSurface) -> None:
+        """
+        Works out the edges leaving a surface
+        """
+        source.edges = []
+        for target in self.nearby_surfaces(source):
+            if target is not source:
+                edge = self.find_edge(source, target)
+                if edge is not None:
+                    source.edges.append(edge)
+
+    def find_edge(self, source: WalkableSurface, target: WalkableSurface):
+        """
+        :return: The cheapest edge from source to target, or None if target can't be reached directly
+        """
+        half_width = self.character_width / 2
+        drop = target.y - source.y
+        gap = source.gap_to(target)
+        target_is_right = target.left >= source.left
+
+        # Surfaces at the same height that touch can just be walked across
+        if drop == 0 and gap == 0 and (source.right == target.left or target.right == source.left):
+            takeoff_x = source.right - half_width if target_is_right else source.left + half_width
+            landing_x = target.left + half_width if target_is_right else target.right - half_width
+            return NavigationEdge(source, target, WALK, takeoff_x, landing_x, abs(landing_x - takeoff_x) / self.horizontal_speed)
+
+        # Horizontal distance the character has to cover in the air
+        distance = gap
+        if gap == 0 and drop < 0 and type(target.platform) is not SemiSolidPlatform:
+            # A solid platform above can't be jumped through, so the character has to go around its edge
+            if source.right - self.character_width >= target.right:
+                target_is_right = False
+            elif source.left + self.character_width <= target.left:
+                target_is_right = True
+            else:
+                return None
+            distance = self.character_width
+
+        if target_is_right:
+            takeoff_x = min(source.right - half_width, max(source.left + half_width, target.left - half_width))
+            landing_x = max(target.left + half_width, min(target.right - half_width, takeoff_x + distance))
+        else:
+            takeoff_x = max(source.left + half_width, min(source.right - half_width, target.right + half_width))
+            landing_x = min(target.right - half_width, max(target.left + half_width, takeoff_x - distance))
+
+        best = None
+        kinds = (FALL, JUMP, HIGH_JUMP) if drop > 0 else (JUMP, HIGH_JUMP)
+        for kind in kinds:
+            frame = self.arcs[kind].landing_frame(drop)
+            if frame is None or frame * self.horizontal_speed < distance:
+                continue
+
+            if kind == FALL:
+                # Falls start by walking off the end of the surface
+                if target_is_right and target.right > source.right:
+                    takeoff_x = source.right - half_width
+                    landing_x = max(landing_x, source.right + half_width)
+                elif not target_is_right and target.left < source.left:
+                    takeoff_x = source.left + half_width
+                    landing_x = min(landing_x, source.left - half_width)
+                else:
+                    continue
+
+            if best is None or frame < best.cost:
+                best = NavigationEdge(source, target, kind, takeoff_x, landing_x, frame)
+
+        return best
+
+    #### Moving platforms ####
+    def refresh_moving(self) -> None:
+        """
+        Call once per frame after the moving platforms have been updated
+        """
+        for surface, built_at in self.moving_surfaces.items():
+            platform = surface.platform
+            if (abs(platform.rect.left - built_at[0]) < self.refresh_distance and
+                    abs(platform.rect.top - built_at[1]) < self.refresh_distance):
+                continue
+
+            neighbours = self.nearby_surfaces(surface)
+            self.moving_surfaces[surface] = platform.rect.topleft
+            surface.left = platform.rect.left
+            surface.right = platform.rect.right
+            surface.y = platform.rect.top
+            surface.rect.topleft = (surface.left, surface.y)
+            self.surface_index.move(surface)
+
+            # Its own edges, and the edges from everything near it (before and after the move)
+            self.connect(surface)
+            for other in dict.fromkeys(neighbours + self.nearby_surfaces(surface)):
+                if other is not surface:
+                    other.edges = [edge for edge in other.edges if edge.target is not surface]
+                    edge = self.find_edge(other, surface)
+                    if edge is not None:
+                        other.edges.append(edge)
+            self.invalidate(surface)
+
+    def invalidate(self, surface: WalkableSurface) -> None:
+        """
+        Throws away the cached paths through a surface, and any "no path" results (which might now have a path)
+        """
+        for key in self.cache_keys_by_surface.pop(surface, ()):
+            self.path_cache.pop(key, None)
+
+        for key in [key for key, path in self.path_cache.items() if path is None]:
+            del self.path_cache[key]
+
+    #### Queries ####
+    def surface_under(self, point: tuple, max_depth: int = 1000):
+        """
+        :return: The highest surface at or below a point (e.g. the bottom middle of a character)
+        """
+        column = pygame.Rect(point[0], point[1], 1, max_depth)
+        best = None
+        for surface in self.surface_index.query(column):
+            if surface.left <= point[0] < surface.right and point[1] <= surface.y <= point[1] + max_depth:
+                if best is None or surface.y < best.y:
+                    best = surface
+        return best
+
+    def find_path(self, start: WalkableSurface, goal: WalkableSurface):
+        """
+        A* search over the surfaces, cached
+        :return: The list of edges to follow, or None if the goal can't be reached
+        """
+        key = (start, goal)
+        if key in self.path_cache:
+            return self.path_cache[key]
+
+        def heuristic(surface):
+            # Characters never move sideways faster than horizontal_speed, so this never overestimates
+            return surface.gap_to(goal) / self.horizontal_speed
+
+        counter = 0  # Breaks ties in the heap without comparing surfaces
+        open_heap = [(heuristic(start), counter, start)]
+        best_cost = {start: 0}
+        came_by = {}
+        path = None
+
+        while open_heap:
+            _, _, surface = heapq.heappop(open_heap)
+            if surface is goal:
+                path = []
+                while surface is not start:
+                    edge = came_by[surface]
+                    path.append(edge)
+                    surface = edge.source
+                path.reverse()
+                break
+
+            for edge in surface.edges:
+                cost = best_cost[surface] + edge.cost
+                if edge.target not in best_cost or cost < best_cost[edge.target]:
+                    best_cost[edge.target] = cost
+                    came_by[edge.target] = edge
+                    counter += 1
+                    heapq.heappush(open_heap, (cost + heuristic(edge.target), counter, edge.target))
+
+        if path is None:
+            self.path_cache[key] = None
+            return None
+
+        # Every part of a shortest path is also a shortest path, so cache them all
+        for i, edge in enumerate(path):
+            sub_key = (edge.source, goal)
+            self.path_cache[sub_key] = path[i:]
+            for step in path[i:]:
+                self.cache_keys_by_surface.setdefault(step.source, set()).add(sub_key)
+            self.cache_keys_by_surface.setdefault(goal, set()).add(sub_key)
+        return path
+
+    def next_edge(self, position: tuple, target: tuple):
+        """
+        :param position: Where the character is (the bottom middle of its rect)
+        :param target: Where it wants to go
+        :return: The first edge to follow, or None if it is already on the target's surface (or can't get there)
+        """
+        # Characters standing on a surface can be a pixel into it
+        start = self.surface_under((position[0], position[1] - 2), max_depth=4)
+        goal = self.surface_under(target)
+        if start is None or goal is None or start is goal:
+            return None
+
+        path = self.find_path(start, goal)
+        if not path:
+            return None
+        return path[0]
@@ -0,0 +1,39 @@
+import threading
+
+
+class FrameBuffer:
+    """
+    Holds the newest frame snapshot, shared between the simulation thread and the render thread.
+    The simulation thread publishes each finished snapshot, replacing the previous one; the render thread
+    always draws the newest (so if it falls behind, it skips frames instead of drawing old ones).
+    Snapshots are immutable, so the renderer can draw one without holding the lock while the next
+    frame is being simulated.
+    """
+    def __init__(self):
+        self.latest = None
+        self.frame_number = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def publish(self, snapshot) -> None:
+        with self.condition:
+            self.latest = snapshot
+            self.frame_number += 1
+            self.condition.notify_all()
+
+    def wait_for_frame(self, last_frame: int, timeout: float = None) -> tuple:
+        """
+        Waits until a frame newer than last_frame has been published (or the buffer is closed)
+        :return: (frame number, snapshot) of the newest frame
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame_number > last_frame or self.closed, timeout)
+            return self.frame_number, self.latest
+
+    def close(self) -> None:
+        """
+        Called when the simulation stops, so the renderer doesn't wait forever
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
@@ -0,0 +1,49 @@
+"""
+Cold-start timing harness.
+Starts main.py in a fresh Python process several times and measures how long it takes to get the first frame
+on screen (this includes starting Python and importing pygame, like a player would see).
+Usage: python startupTiming.py [number of runs]
+Set SDL_VIDEODRIVER=dummy to run it without a window (e.g. on a build server).
+"""
+import os
+import subprocess
+import sys
+import time
+
+# Time-to-first-frame budget in milliseconds
+TARGET_MS = 400
+
+
+def time_to_first_frame() -> float:
+    """
+    :return: Milliseconds from starting the process to main.py reporting its first frame
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "main.py", "--first-frame-only"], cwd=folder,
+                               stdout=subprocess.PIPE, text=True)
+    elapsed = None
+    for line in process.stdout:
+        if line.startswith("First frame"):
+            elapsed = (time.perf_counter() - start) * 1000
+    process.wait()
+
+    if elapsed is None:
+        raise RuntimeError("main.py exited without drawing a frame")
+    return elapsed
+
+
+def main(runs: int) -> int:
+    times = sorted(time_to_first_frame() for _ in range(runs))
+    median = times[len(times) // 2]
+    print("Time to first frame over " + str(runs) + " runs: min " + str(round(times[0])) + " ms, median " +
+          str(round(median)) + " ms, max " + str(round(times[-1])) + " ms (target " + str(TARGET_MS) + " ms)")
+
+    if median > TARGET_MS:
+        print("Over the start-up budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5))